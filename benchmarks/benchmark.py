@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Benchmarks for normalize-plex-files
+
+Generates a synthetic Plex library (see synthlib.py) in a temporary
+directory and times the phases of a normalize-plex-files run separately:
+- query: executing the search queries and fetching all rows,
+- plan:  a complete run with --plan, i.e. query and computing the moves,
+- moves: executing the plan armed with --apply, i.e. moving the files.
+Then runs microbenchmarks of the hot helper functions in utils.py.
+
+Nothing outside the temporary directory is touched; the config file
+~/.plex is not read, as HOME points to the temporary directory.
+"""
+
+import getopt
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PACKAGE = os.path.join(os.path.dirname(HERE), "normalize-plex-files")
+sys.path.insert(0, PACKAGE)
+
+import synthlib                             # noqa: E402
+import utils                                # noqa: E402
+from sqlsearchmovies import moviessearch    # noqa: E402
+from sqlsearchseries import seriessearch    # noqa: E402
+
+
+def usage(message):
+    print(f"""usage: {sys.argv[0]} [-m movies] [-t shows] [--seasons #] [--episodes #] \\
+            [--multipart #] [-j jobs] [--asyncio] [--nofiles] [--noindexes] [--keep dir] \\
+            [--micro #]
+
+    -m | --movies #         number of movies, default: 10000
+    -t | --shows #          number of tv shows, default: 200
+         --seasons #        seasons per tv show, default: 5
+         --episodes #       episodes per season, default: 10
+         --multipart #      every #th movie has two parts (0: none), default: 10
+    -j | --jobs #           number of files moved in parallel, default: 1
+         --asyncio          move the files with the asyncio executor
+         --nofiles          do not create media files, skip the moves phase
+         --noindexes        create the database without Plex's indexes
+         --keep dir         generate the library in dir and keep it
+         --micro #          iterations of the microbenchmarks (0: skip), default: 100000
+
+{message}
+""", file=sys.stderr)
+    sys.exit(2)
+
+
+def timed(name: str, func, *args, **kwargs):
+    """calls {func}, prints the time it took and returns its result."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    print(f"{name:<10} {time.perf_counter() - start:9.3f}s")
+    return result
+
+
+def query(database: str) -> int:
+    """executes both search queries on {database}, fetches all rows
+    grouped with utils.groupparts() and returns the number of media parts."""
+    con = sqlite3.connect(database)
+    try:
+        count = 0
+        for search, params in (
+            (moviessearch, {"movies_sections": '["Filme"]', "since": None}),
+            (seriessearch, {"series_sections": '["Serien"]', "since": None}),
+        ):
+            for _, parts in utils.groupparts(con.execute(search, params)):
+                count += len(parts)
+        return count
+    finally:
+        con.close()
+
+
+def run(root: str, database: str, *args: str) -> None:
+    """runs normalize-plex-files with {args} on the library in {root}."""
+    env = {
+        **os.environ,
+        "HOME":             root,
+        "PLEX_DATABASE":    database,
+        "PLEX_MOVIESBASE":  os.path.join(root, "Filme"),
+        "PLEX_SERIESBASE":  os.path.join(root, "Serien"),
+    }
+    subprocess.run([sys.executable, PACKAGE, *args], env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+class Rows:
+    """cursor returning a list of {rows}, for the groupparts() benchmark."""
+
+    def __init__(self, rows: list[tuple]):
+        self.rows = rows
+        self.pos = 0
+
+    def fetchmany(self, size: int) -> list[tuple]:
+        rows = self.rows[self.pos:self.pos + size]
+        self.pos += size
+        return rows
+
+
+def micro(number: int) -> None:
+    """times the helper functions called once per media part."""
+    base = "/data/plex/Filme/"
+    file = "/data/plex/Filme/a/some movie/some movie.cd1.mkv"
+    title = "Mission: Impossible - Dead Reckoning Part One (2023) [3840x2160]"
+    # 1000 media items, every 10th in two parts
+    rows = [
+        ("title", 2000, None, "tmdb-1", 1920, 1080, n, n, 0, f"/{n}/{part}.mkv")
+        for n in range(1000) for part in range(2 if n % 10 == 0 else 1)
+    ]
+
+    for name, stmt in (
+        ("sanitize_filename", lambda: utils.sanitize_filename(title)),
+        ("basedir", lambda: utils.basedir(base, file, 1)),
+        ("groupparts", lambda: sum(1 for _ in utils.groupparts(Rows(rows)))),
+    ):
+        # groupparts() processes len(rows) rows per call
+        n = number // len(rows) if name == "groupparts" else number
+        secs = timeit.timeit(stmt, number=max(n, 1))
+        per = len(rows) if name == "groupparts" else 1
+        print(f"{name:<18} {secs / max(n, 1) / per * 1e6:8.3f}µs per part")
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "m:t:j:", [
+            "movies=", "shows=", "seasons=", "episodes=", "multipart=",
+            "jobs=", "asyncio", "nofiles", "noindexes", "keep=", "micro=",
+        ])
+    except getopt.GetoptError as err:
+        usage(err)
+    if args:
+        usage(f"unexpected arguments: {' '.join(args)}")
+
+    options = {
+        "movies": 10000, "shows": 200, "seasons": 5, "episodes": 10,
+        "multipart": 10, "jobs": 1, "micro": 100000,
+    }
+    files, indexes, keep = True, True, None
+    moveoptions = []
+    for opt, arg in opts:
+        if opt == "--asyncio":
+            moveoptions.append(opt)
+        elif opt == "--nofiles":
+            files = False
+        elif opt == "--noindexes":
+            indexes = False
+        elif opt == "--keep":
+            keep = arg
+        else:
+            key = {"-m": "movies", "-t": "shows", "-j": "jobs"}.get(
+                opt, opt.lstrip("-"))
+            try:
+                options[key] = int(arg)
+            except ValueError:
+                usage(f"{opt} requires a number")
+
+    if keep:
+        os.makedirs(keep)
+        root = keep
+    else:
+        root = tempfile.mkdtemp(prefix="normalize-plex-files-bench-")
+
+    try:
+        database = timed(
+            "generate", synthlib.generate, root,
+            movies=options["movies"], shows=options["shows"],
+            seasons=options["seasons"], episodes=options["episodes"],
+            multipart=options["multipart"], files=files, indexes=indexes)
+        plan = os.path.join(root, "plan.jsonl")
+
+        count = timed("query", query, database)
+        timed("plan", run, root, database, "-mT", "--plan", plan)
+        if files:
+            timed("moves", run, root, database, "--apply", plan, "--armed",
+                  "-r", "-j", str(options["jobs"]), *moveoptions)
+        print(f"{count} media parts")
+    finally:
+        if not keep:
+            shutil.rmtree(root)
+
+    if options["micro"]:
+        print()
+        micro(options["micro"])
+
+
+if __name__ == "__main__":
+    main()
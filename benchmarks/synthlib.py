@@ -0,0 +1,212 @@
+"""Synthetic Plex Library for the normalize-plex-files benchmarks
+
+generate() creates a Plex database containing the tables and columns used
+by the search queries (library_sections, metadata_items, media_items,
+media_parts, taggings, tags), with one movies and one series library of
+configurable size, and - unless disabled - a matching tree of empty media
+files. The files are deliberately misnamed, so normalize-plex-files has
+to move every one of them.
+
+Layout of the generated tree below {root}:
+    Filme/<letter>/<movie folder>/<movie file>[.de.srt]
+    Serien/<letter>/<show folder>/<season folder>/<episode file>
+"""
+
+import os
+import sqlite3
+from typing import Iterator
+
+SCHEMA = """
+CREATE TABLE library_sections (
+    id INTEGER PRIMARY KEY,
+    name TEXT
+);
+CREATE TABLE metadata_items (
+    id INTEGER PRIMARY KEY,
+    library_section_id INTEGER,
+    parent_id INTEGER,
+    metadata_type INTEGER,
+    title TEXT,
+    year INTEGER,
+    edition_title TEXT,
+    "index" INTEGER,
+    updated_at INTEGER
+);
+CREATE TABLE media_items (
+    id INTEGER PRIMARY KEY,
+    metadata_item_id INTEGER,
+    width INTEGER,
+    height INTEGER,
+    updated_at INTEGER
+);
+CREATE TABLE media_parts (
+    id INTEGER PRIMARY KEY,
+    media_item_id INTEGER,
+    file TEXT,
+    "index" INTEGER,
+    updated_at INTEGER
+);
+CREATE TABLE tags (
+    id INTEGER PRIMARY KEY,
+    tag TEXT,
+    tag_type INTEGER
+);
+CREATE TABLE taggings (
+    id INTEGER PRIMARY KEY,
+    metadata_item_id INTEGER,
+    tag_id INTEGER
+);
+"""
+
+# indexes of a real Plex database on the columns the search queries use
+INDEXES = """
+CREATE INDEX index_metadata_items_on_library_section_id ON metadata_items (library_section_id);
+CREATE INDEX index_metadata_items_on_parent_id ON metadata_items (parent_id);
+CREATE INDEX index_media_items_on_metadata_item_id ON media_items (metadata_item_id);
+CREATE INDEX index_media_parts_on_media_item_id ON media_parts (media_item_id);
+CREATE INDEX index_taggings_on_metadata_item_id ON taggings (metadata_item_id);
+"""
+
+MOVIES_SECTION = 1
+SERIES_SECTION = 2
+
+# metadata_type of movies, shows, seasons and episodes
+MOVIE, SHOW, SEASON, EPISODE = 1, 2, 3, 4
+
+# tag_type of external database ids (imdb://, tmdb://, tvdb://)
+GUID = 314
+
+# (width, height) of the media items, used round robin
+RESOLUTIONS = ((1920, 1080), (1280, 720), (720, 576), (3840, 2160))
+
+# rows inserted per executemany()
+BATCHSIZE = 10000
+
+
+def _title(kind: str, n: int) -> str:
+    """returns a title for item {n}, with a few special characters
+    sanitize_filename() has to replace."""
+    special = ("", ": The Return", "?", " / Reloaded", "")[n % 5]
+    return f"{kind} {n:07d}{special}"
+
+
+def _batched(rows: Iterator[tuple]) -> Iterator[list[tuple]]:
+    """yields the {rows} in lists of BATCHSIZE rows."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCHSIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(root: str, movies: int = 1000, shows: int = 50,
+             seasons: int = 5, episodes: int = 10, multipart: int = 10,
+             files: bool = True, indexes: bool = True) -> str:
+    """creates a synthetic Plex library below directory {root} and returns
+    the path of its database:
+    - {movies} movies, every {multipart}th of them in two parts
+      (0: no multipart movies), every other one with a subtitle file,
+    - {shows} tv shows with {seasons} seasons of {episodes} episodes each.
+    The total number of media parts is about
+    movies * (1 + 1/multipart) + shows * seasons * episodes.
+    Empty media files are created unless {files} is false, the indexes of
+    a real Plex database unless {indexes} is false."""
+    database = os.path.join(root, "com.plexapp.plugins.library.db")
+    moviesbase = os.path.join(root, "Filme")
+    seriesbase = os.path.join(root, "Serien")
+
+    con = sqlite3.connect(database)
+    con.executescript(SCHEMA)
+    con.executemany("INSERT INTO library_sections VALUES (?, ?)", (
+        (MOVIES_SECTION, "Filme"),
+        (SERIES_SECTION, "Serien"),
+    ))
+
+    ids = iter(range(1, 1 << 62))
+    metadata, media, parts, taggings, tags = [], [], [], [], []
+    paths = []
+
+    def flush(force: bool = False) -> None:
+        if not force and len(parts) < BATCHSIZE:
+            return
+        con.executemany(
+            "INSERT INTO metadata_items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            metadata)
+        con.executemany(
+            "INSERT INTO media_items VALUES (?, ?, ?, ?, ?)", media)
+        con.executemany(
+            "INSERT INTO media_parts VALUES (?, ?, ?, ?, ?)", parts)
+        con.executemany(
+            "INSERT INTO tags VALUES (?, ?, ?)", tags)
+        con.executemany(
+            "INSERT INTO taggings VALUES (?, ?, ?)", taggings)
+        if files:
+            for path in paths:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                open(path, "xb").close()
+        for batch in (metadata, media, parts, taggings, tags, paths):
+            batch.clear()
+
+    def tag(item: int, guid: str) -> None:
+        id = next(ids)
+        tags.append((id, guid, GUID))
+        taggings.append((id, item, id))
+
+    for n in range(movies):
+        item = next(ids)
+        width, height = RESOLUTIONS[n % len(RESOLUTIONS)]
+        title = _title("Movie", n)
+        edition = "Director's Cut" if n % 50 == 0 else None
+        metadata.append((item, MOVIES_SECTION, None, MOVIE,
+                         title, 1950 + n % 75, edition, None, n))
+        tag(item, f"tmdb://{n}")
+        if n % 3 == 0:
+            tag(item, f"imdb://tt{n:07d}")
+
+        media_item = next(ids)
+        media.append((media_item, item, width, height, n))
+        dir = os.path.join(moviesbase, chr(ord("a") + n % 26), f"movie{n}")
+        for index in range(2 if multipart and n % multipart == 0 else 1):
+            old_file = os.path.join(dir, f"movie{n}.cd{index + 1}")
+            parts.append((next(ids), media_item, old_file + ".mkv",
+                          index, n))
+            paths.append(old_file + ".mkv")
+            if n % 2 == 0:
+                paths.append(old_file + ".de.srt")
+        flush()
+
+    for s in range(shows):
+        show = next(ids)
+        title = _title("Show", s)
+        metadata.append((show, SERIES_SECTION, None, SHOW,
+                         title, 1990 + s % 35, None, None, s))
+        tag(show, f"tvdb://{s}")
+        dir = os.path.join(seriesbase, chr(ord("a") + s % 26), f"show{s}")
+
+        for season in range(1, seasons + 1):
+            season_item = next(ids)
+            metadata.append((season_item, SERIES_SECTION, show, SEASON,
+                             None, None, None, season, s))
+            for episode in range(1, episodes + 1):
+                item = next(ids)
+                width, height = RESOLUTIONS[episode % len(RESOLUTIONS)]
+                metadata.append((item, SERIES_SECTION, season_item, EPISODE,
+                                 f"Episode {episode}", None, None, episode, s))
+                media_item = next(ids)
+                media.append((media_item, item, width, height, s))
+                file = os.path.join(dir, f"S{season}",
+                                    f"s{season:02d}e{episode:02d}.mkv")
+                parts.append((next(ids), media_item, file, 0, s))
+                paths.append(file)
+            flush()
+
+    flush(force=True)
+    if indexes:
+        con.executescript(INDEXES)
+    con.commit()
+    con.close()
+
+    return database
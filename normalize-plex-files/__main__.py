@@ -2,184 +2,280 @@
 import sqlite3
 import os.path
 import sys
+import json
+import cProfile
 from sqlsearchmovies import moviessearch
 from sqlsearchseries import seriessearch
-import utils
+import state
+import database
+import explain
+import naming
+import stats
+import watch
+import journal
+import pipeline
+import scheduler
+import rescan
+import profiles
+from executor import MoveExecutor
+from asyncexecutor import AsyncMoveExecutor
+from dirmanager import DirBatch
+from dirrename import DirRename
+from preflight import Preflight
+from plan import PlanWriter, readplan
 from config import getconfig
 
 
-def main():
-
-    config = getconfig()
-
-    if not config.armed:
-        print("Simulation only.")
+def startjournal(config):
+    """starts the journal of an armed run in {config.journal}, unless the
+    journal contains an interrupted run."""
+    if not config.armed or not config.journal:
+        return
 
     try:
-        con = sqlite3.connect(config.database)
-    except sqlite3.OperationalError as e:
-        print(f"{e}: {config.database}")
+        if journal.unfinished(config.journal):
+            print(f"{config.journal}: the previous run has been interrupted, "
+                  "finish it with --resume or revert it with --undo.",
+                  file=sys.stderr)
+            sys.exit(1)
+        journal.begin(config.journal)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
         sys.exit(1)
 
-    cur = con.cursor()
-
-    if config.movies:
-        if config.debug:
-            print("Searching database.", file=sys.stderr)
-
-        res = cur.execute(
-            moviessearch, {"movies_section_name": config.movieslibrary}
-        )
-
-        if config.debug:
-            print("Parsing result.", file=sys.stderr)
-
-        for row in res:
-            title, year, edition, db_ref, width, height, files = row
-
-            parts = utils.deserializefilenames(files)
-
-            if config.debug:
-                print(title, parts, file=sys.stderr)
-
-            for idx, part in enumerate(parts):
-
-                try:
-                    base_dir = utils.basedir(
-                        config.moviesbase, part, config.moviessubdirs
-                    )
-                except ValueError as e:
-                    print(e, file=sys.stderr)
-                    continue    # skip this file and continue with next
-
-                resolution = utils.resolutionstring(height, width)
-
-                if config.ownmoviefolder:
-
-                    dir = f"{title} ({year})"
-
-                    if edition:
-                        dir += f" {{edition-{edition}}}"
 
-                    if db_ref:
-                        dir += f" {{{db_ref}}}"
+def libraries(configured, fields):
+    """returns the {configured} libraries (see config.py) by name, as
+    (library, naming template) tuples, compiling the templates with
+    {fields}. Libraries with the same template share the compiled template
+    and its memoized folder names. Raises ValueError if a template is
+    invalid."""
+    templates = {}
+    result = {}
+    for library in configured:
+        if library.template not in templates:
+            templates[library.template] = naming.Template(library.template,
+                                                          fields)
+        result[library.name] = (library, templates[library.template])
+    return result
 
-                    base_dir = os.path.join(
-                        base_dir, utils.sanitize_filename(dir)
-                    )
 
-                    file = utils.sanitize_filename(
-                        f"{title} ({year}){resolution}"
-                    )
+def apply(config):
+    """executes the moves of plan file {config.apply}."""
 
-                    if config.armed:
-                        try:
-                            os.mkdir(base_dir)
-                        except FileExistsError:
-                            pass
-                        except Exception as e:
-                            print(e, file=sys.stderr)
-
-                else:
-                    if config.debug:
-                        print(f"base_dir: {base_dir}", file=sys.stderr)
-
-                    file = f"{title} ({year})"
-
-                    if edition:
-                        file += f" {{edition-{edition}}}"
-
-                    if db_ref:
-                        file += f" {{{db_ref}}}"
-
-                    file += resolution
+    if not config.armed:
+        print("Simulation only.")
 
-                if len(parts) > 1:
-                    # multipart
-                    file += f" - part{idx+1}"
+    # read completely first, so a malformed line moves nothing
+    try:
+        moves = list(readplan(config.apply))
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
 
-                new_file = os.path.join(
-                    base_dir, utils.sanitize_filename(file)
-                )
+    startjournal(config)
 
-                # old filename without extension
-                old_file = os.path.splitext(part)[0]
+    executor = AsyncMoveExecutor(config) if config.asyncio \
+        else MoveExecutor(config)
+    if config.mkdirsfirst:
+        executor = DirBatch(executor, config)
+    if config.dirrename:
+        executor = DirRename(executor, config)
+    if config.collisions != "off":
+        executor = Preflight(executor, config)
+    if config.deviceorder:
+        # outermost, so the collision check sees the final order
+        executor = scheduler.DeviceScheduler(executor, config)
 
-                utils.movemedia(old_file, new_file, config)
+    for move in moves:
+        stats.count("moves")
+        executor.submit([move])
 
-    if config.series:
-        if config.debug:
-            print("Searching database.", file=sys.stderr)
+    executor.close()
+    journal.end()
 
-        res = cur.execute(
-            seriessearch, {"series_section_name": config.serieslibrary}
-        )
+    if not config.armed:
+        print("End simulation only.")
 
-        if config.debug:
-            print("Parsing result.", file=sys.stderr)
 
-        for row in res:
-            series, year, db_ref, season, episode, title, width, height, files = row
+def normalize(config, con=None):
+    """searches the database and moves the media files.
+    Uses the open database connection {con}, if given."""
 
-            parts = utils.deserializefilenames(files)
+    if not config.armed and not config.plan and not config.explain:
+        print("Simulation only.")
 
-            if not title:
-                title = f"Folge {episode}"
+    try:
+        movieslibraries = libraries(config.movieslibraries,
+                                    naming.MOVIEFIELDS)
+        serieslibraries = libraries(config.serieslibraries,
+                                    naming.SERIESFIELDS)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
 
+    connected = con is None
+    if connected:
+        try:
+            with stats.timed("connect"):
+                con = database.connect(config)
+        except sqlite3.Error as e:
+            print(f"{e}: {config.database}")
+            sys.exit(1)
+
+    if config.explain:
+        if config.movies:
+            explain.explain(con, "movies", moviessearch, {
+                "movies_sections": json.dumps(list(movieslibraries)),
+                "since": None,
+            })
+        if config.series:
+            explain.explain(con, "series", seriessearch, {
+                "series_sections": json.dumps(list(serieslibraries)),
+                "since": None,
+            })
+        if connected:
+            con.close()
+        return
+
+    if config.plan:
+        try:
+            executor = PlanWriter(config.plan)
+        except OSError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+    else:
+        executor = AsyncMoveExecutor(config) if config.asyncio \
+            else MoveExecutor(config)
+        if config.mkdirsfirst:
+            executor = DirBatch(executor, config)
+        if config.dirrename:
+            executor = DirRename(executor, config)
+    if config.collisions != "off":
+        executor = Preflight(executor, config)
+    if config.deviceorder:
+        # outermost, so the collision check sees the final order
+        executor = scheduler.DeviceScheduler(executor, config)
+
+    if not config.plan:
+        startjournal(config)
+
+    if config.incremental:
+        try:
+            statecon = state.connect(config.statefile)
+        except sqlite3.Error as e:
+            print(f"{e}: {config.statefile}")
+            sys.exit(1)
+        db_path = os.path.abspath(config.database)
+
+    changes = None
+    if (config.changedfile or config.plexurl) and not config.plan:
+        changes = rescan.Changes()
+
+    done = None
+    if (config.incremental and config.armed) or changes is not None:
+        def done(item, moves, success):
+            if changes is not None:
+                changes.record(item.section, moves)
+            if config.incremental and config.armed:
+                state.record(statecon, db_path, item.section,
+                             item.metadata_item_id, item.media_item_id,
+                             item.changed_at, success)
+
+    for kind, search, record, libs in (
+        ("movies", moviessearch, pipeline.Movie, movieslibraries),
+        ("series", seriessearch, pipeline.Episode, serieslibraries),
+    ):
+        if not getattr(config, kind):
+            continue
+
+        since = None
+        if config.incremental:
+            since = state.since(statecon, db_path, list(libs))
             if config.debug:
-                print(title, parts, file=sys.stderr)
-
-            for idx, part in enumerate(parts):
-
-                try:
-                    base_dir = utils.basedir(
-                        config.seriesbase, part, config.seriessubdirs
-                    )
-                except ValueError as e:
-                    print(e, file=sys.stderr)
-                    continue    # skip this file and continue with next
-
-                resolution = utils.resolutionstring(height, width)
-
-                folder = f"{series} ({year})"
-
-                if db_ref:
-                    folder += f" {{{db_ref}}}"
-
-                base_dir = os.path.join(
-                    base_dir, utils.sanitize_filename(folder))
-
-                if config.ownseasonfolder:
-                    base_dir = os.path.join(
-                        base_dir, utils.sanitize_filename(f"Season {season}"))
-
-                if config.armed:
-                    try:
-                        os.mkdir(base_dir)
-                    except FileExistsError:
-                        pass
-                    except Exception as e:
-                        print(e, file=sys.stderr)
-
-                file = f"{season:02}x{episode:02} {series} - {title}{resolution}"
+                print(f"Changed since: {since}", file=sys.stderr)
+
+        # fetch -> decode -> name -> execute, see pipeline.py
+        groups = pipeline.fetch(con, search, {
+            f"{kind}_sections": json.dumps(list(libs)),
+            "since": since,
+        }, config)
+        items = pipeline.decode(groups, record)
+        jobs = pipeline.name(items, libs, config)
+        pipeline.execute(jobs, executor, done)
+
+    executor.close()
+    journal.end()
+
+    if changes is not None:
+        sections = {
+            name: library
+            for libs in (movieslibraries, serieslibraries)
+            for name, (library, _) in libs.items()
+        }
+        if config.changedfile:
+            try:
+                rescan.write(config.changedfile, changes, sections,
+                             config.scanbatch)
+            except OSError as e:
+                print(e, file=sys.stderr)
+                stats.count("errors")
+        if config.plexurl and config.armed:
+            rescan.scan(config, con, changes, sections)
+
+    if connected:
+        con.close()
+
+    if config.incremental:
+        statecon.commit()
+        statecon.close()
+
+    if not config.armed and not config.plan:
+        print("End simulation only.")
 
-                if len(parts) > 1:
-                    # multipart
-                    file += f" - part{idx+1}"
 
-                new_file = os.path.join(
-                    base_dir, utils.sanitize_filename(file)
-                )
+def main():
 
-                # old filename without extension
-                old_file = os.path.splitext(part)[0]
+    with stats.timed("config"):
+        config = getconfig()
 
-                utils.movemedia(old_file, new_file, config)
+    scheduler.setup(config)
 
-    con.close()
+    if config.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
 
-    if not config.armed:
-        print("End simulation only.")
+    failed = False
+    try:
+        if config.apply:
+            apply(config)
+        elif config.resume:
+            journal.resume(config)
+        elif config.undo:
+            journal.undo(config)
+        elif config.watch:
+            watch.watch(config, normalize)
+        elif config.profilenames:
+            failed = not profiles.run(config, normalize)
+        else:
+            normalize(config)
+    finally:
+        if config.profile:
+            profiler.disable()
+            try:
+                profiler.dump_stats(config.profile)
+            except OSError as e:
+                print(e, file=sys.stderr)
+
+    if config.stats:
+        try:
+            stats.write(config.stats, config.statsformat)
+        except OSError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,143 @@
+"""Asyncio Executor Module for normalize-plex-files
+
+Runs the moves of media files on an asyncio event loop (config.asyncio),
+for media on network shares (SMB, NFS), where every file system call takes
+milliseconds and a sequential run spends almost all of its time waiting.
+
+As with executor.MoveExecutor, moves are submitted in jobs, one job per
+media item, jobs sharing a source or target directory are run in the order
+they have been submitted, and output is reported in submission order.
+Within these limits, the file system calls of many jobs are in flight at
+the same time: each call (listing a directory, mkdir, link or copy, unlink)
+is run in a pool of config.jobs threads, and the files of a media item
+(e.g. the video and its subtitles) are moved concurrently.
+
+Besides the total of config.jobs, at most config.mountjobs calls are in
+flight per mount (the filesystem of the source directory of a move), so a
+single slow share cannot occupy all threads. Files are still moved without
+overwriting, and only unlinked after they have been linked or copied (see
+utils.movefile()).
+"""
+
+import asyncio
+import concurrent.futures
+import io
+import os
+import threading
+from types import SimpleNamespace
+import crossmove
+import dirindex
+import dirmanager
+import journal
+import stats
+import utils
+from executor import MoveExecutor
+
+
+def _makedirs(dir: str, config: SimpleNamespace, err) -> bool:
+    with stats.timed("mkdir"):
+        return dirmanager.makedirs(dir, config, err)
+
+
+class AsyncMoveExecutor(MoveExecutor):
+    """Executes move jobs on an asyncio event loop, see module
+    documentation. Can be used in place of an executor.MoveExecutor."""
+
+    def __init__(self, config: SimpleNamespace):
+        super().__init__(config)
+        if self.pool is None:
+            self.pool = concurrent.futures.ThreadPoolExecutor(config.jobs)
+        # directory -> st_dev, None if unknown
+        self.devices = {}
+        # st_dev -> semaphore limiting the calls in flight on that mount
+        self.mounts = {}
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.pool)
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def close(self) -> None:
+        """waits for all submitted jobs and reports them, then removes the
+        emptied source directories and stops the event loop."""
+        super().close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def _start(self, moves, predecessors) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(
+            self._job(moves, predecessors), self.loop)
+
+    async def _job(self, moves, predecessors):
+        if predecessors:
+            await asyncio.wait([asyncio.wrap_future(f) for f in predecessors])
+        out = io.StringIO()
+        err = io.StringIO()
+        try:
+            success = await self._arun(moves, out, err)
+        except Exception as e:
+            print(e, file=err)
+            stats.count("errors")
+            success = False
+        return success, out.getvalue(), err.getvalue()
+
+    async def _call(self, file: str, func, *args):
+        """runs {func}(*args) in the thread pool, limited by the semaphore
+        of the mount of {file}'s directory."""
+        dir = os.path.dirname(file)
+        if dir not in self.devices:
+            try:
+                self.devices[dir] = await self.loop.run_in_executor(
+                    None, crossmove.device, dir)
+            except OSError:
+                self.devices[dir] = None
+        dev = self.devices[dir]
+        if dev not in self.mounts:
+            self.mounts[dev] = asyncio.Semaphore(self.config.mountjobs)
+        async with self.mounts[dev]:
+            return await self.loop.run_in_executor(None, func, *args)
+
+    async def _movefile(self, file: str, new_file: str):
+        # own buffers, as the files of a move are moved concurrently
+        out = io.StringIO()
+        err = io.StringIO()
+        moved = await self._call(file, utils.movefile, file, new_file,
+                                 out, err)
+        return moved, out.getvalue(), err.getvalue()
+
+    async def _arun(self, moves, out, err) -> bool:
+        if not self.config.armed:
+            # nothing is touched, only printed
+            return self._run(moves, out, err)
+
+        sidecars = await asyncio.gather(*(
+            self._call(move.old_file, dirindex.sidecars, move.old_file)
+            for move in moves
+        ))
+        await self.loop.run_in_executor(None, journal.intend, [
+            (file, move.new_file + file[len(move.old_file):])
+            for move, files in zip(moves, sidecars)
+            if move.old_file != move.new_file
+            for file in files
+        ])
+
+        success = True
+        for move, files in zip(moves, sidecars):
+            moved = True
+            if move.mkdir is not None:
+                moved = await self._call(move.old_file, _makedirs,
+                                         move.mkdir, self.config, err)
+            if moved and move.old_file != move.new_file:
+                for result, file_out, file_err in await asyncio.gather(*(
+                    self._movefile(
+                        file, move.new_file + file[len(move.old_file):])
+                    for file in files
+                )):
+                    out.write(file_out)
+                    err.write(file_err)
+                    moved = moved and result
+            self.cleanup.finished(move, moved)
+            if not moved:
+                success = False
+        return success
@@ -14,14 +14,73 @@ import sys
 import os
 from types import SimpleNamespace
 import json
+import urllib.parse
 from version import VERSION
+from database import SNAPSHOTS
+from stats import FORMATS
+from preflight import COLLISIONS
+import shard
+import scheduler
+import naming
 
 
-def getconfig() -> SimpleNamespace:
-    """Gets various config variables from the environment or from the commandline."""
+def _libraries(value, base: str, subdirs: int,
+               template: str) -> list[SimpleNamespace]:
+    """returns the libraries configured by {value}, a library name or a
+    list of library names and objects like
+        {"name": "Kinderfilme", "base": "/data/plex/Kinderfilme/",
+         "subdirs": 0, "template": "..."}
+    as SimpleNamespaces with attributes name, base, subdirs and template.
+    {base}, {subdirs} and {template} are used for the attributes missing.
+    Raises ValueError if {value} is invalid."""
+    if value.__class__ != list:
+        value = [value]
+    if not value:
+        raise ValueError("no library given")
+
+    result = []
+    for entry in value:
+        if entry.__class__ == str:
+            entry = {"name": entry}
+        if entry.__class__ != dict or entry.get("name").__class__ != str:
+            raise ValueError(f"library {entry!r} has no name")
+        library = SimpleNamespace(
+            name=entry["name"],
+            base=entry.get("base", base),
+            subdirs=entry.get("subdirs", subdirs),
+            template=entry.get("template") or template,
+        )
+        if library.base.__class__ != str \
+                or library.template.__class__ != str:
+            raise ValueError(f"library {entry!r}: base and template must be strings")
+        try:
+            library.subdirs = abs(int(library.subdirs))
+        except (TypeError, ValueError):
+            raise ValueError(f"library {entry!r}: subdirs must be of type int")
+        if any(other.name == library.name for other in result):
+            raise ValueError(f"library {library.name!r} is given twice")
+        result.append(library)
+    return result
+
+
+def getconfig(profile: str = None) -> SimpleNamespace:
+    """Gets various config variables from the environment or from the commandline.
+    With {profile}, the settings of that profile in the config file override
+    the other settings of the config file (see profiles.py)."""
 
     def usage(message):
-        print(f"""usage: {sys.argv[0]} {{ -m [-T] | -T [-m] | -v }} [--armed] [-d] [-D database] \\
+        print(f"""usage: {sys.argv[0]} {{ -m [-T] | -T [-m] | --apply planfile | --resume | --undo | -v }} [--armed] [-d] [-D database] \\
+            [--plan planfile] [--snapshot {{off|memory|tempfile}}] [--explain] \\
+            [--incremental] [--statefile file] [-j jobs] [--mkdirsfirst] [--dirrename] \\
+            [--asyncio] [--mountjobs jobs] \\
+            [--collisions {{off|skip|rename|abort}}] \\
+            [--stats file] [--statsformat {{json|prometheus}}] [--profile file] \\
+            [--watch] [--watchinterval seconds] [--watchquiet seconds] \\
+            [--journal file] \\
+            [--shard K/N] [--shardby {{item|subdir}}] [--pathprefix dir]... \\
+            [--iops #] [--bandwidth bytes] [--lowpriority] [--deviceorder] \\
+            [--changedfile file] [--plexurl url] [--scanbatch #] \\
+            [--profiles name,...|all] [--processes #] \\
             [-b moviedir] [-l libraryname] [-s #subdirs] [-o] \\
             [-B seriesdir] [-L libraryname] [-S #subdirs] [-O]
 
@@ -30,17 +89,53 @@ Arguments and Environment Variables:
     -r | --rmdotfiles           PLEX_RMDOTFILES      remove dotfiles in processed media directories, env/default: {config.rmdotfiles}
     -m | --movies                                    process movie files, default: do not process movies
     -b | --moviesbase dir       PLEX_MOVIESBASE      movie files directory, env/default: {config.moviesbase}
-    -l | --movieslibrary name   PLEX_MOVIESLIBRARY   movies library name, eenv/default: {config.movieslibrary}
+    -l | --movieslibrary name   PLEX_MOVIESLIBRARY   movies library name (several in the config file), env/default: {config.movieslibrary}
     -s | --moviessubdirs #      PLEX_MOVIESSUBDIRS   levels of subdirs to retain, env/default: {config.moviessubdirs}
     -o | --ownmoviefolder       PLEX_OWNMOVIEFOLDER  pack each movie in its own movie folder, env/default: {config.ownmoviefolder}
     -T | --tvseries                                  process tv series, default: do not process tv series
     -B | --seriesbase dir       PLEX_SERIESBASE      series files directory, env/default: {config.seriesbase}
-    -L | --serieslibrary name   PLEX_SERIESLIBRARY   series library name, env/default: {config.serieslibrary}
+    -L | --serieslibrary name   PLEX_SERIESLIBRARY   series library name (several in the config file), env/default: {config.serieslibrary}
     -S | --serieessubdirs #     PLEX_SERIESSUBDIRS   levels of subdirs to retain, env/default: {config.moviessubdirs}
     -O | --ownseasonfolder      PLEX_OWNSEASONFOLDER pack each season in its own season folder, env/default: {config.ownseasonfolder}
+                                PLEX_MOVIESTEMPLATE  naming template of movie files, env/default: depends on -o
+                                PLEX_SERIESTEMPLATE  naming template of episode files, env/default: depends on -O
     -d | --debug                                     turn on debug messages, default: no debug messages
     -D | --database file        PLEX_DATABASE        database file, env/default: {config.database}
+         --snapshot where       PLEX_SNAPSHOT        query a read-only copy of the database in memory or in a tempfile, or query it directly (off), env/default: {config.snapshot}
     -v | --version                                   print version and exit
+         --incremental                               only process media changed since the last incremental run, default: process all media
+         --statefile file       PLEX_STATEFILE       state file for --incremental, env/default: {config.statefile}
+    -j | --jobs #               PLEX_JOBS            number of files moved in parallel, env/default: {config.jobs}
+         --asyncio              PLEX_ASYNCIO         pipeline the file system calls of the moves on an asyncio event loop, env/default: {config.asyncio}
+         --mountjobs #          PLEX_MOUNTJOBS       with --asyncio, file system calls in parallel per mount, env/default: {config.mountjobs}
+         --mkdirsfirst          PLEX_MKDIRSFIRST     create all target directories before moving any file, env/default: {config.mkdirsfirst}
+         --dirrename            PLEX_DIRRENAME       rename directories moving as a whole at once, instead of moving their files, env/default: {config.dirrename}
+         --collisions mode      PLEX_COLLISIONS      check all targets for collisions before moving any file, and skip, rename or abort, env/default: {config.collisions}
+         --plan file                                 write moves to plan file (- for stdout) instead of moving files
+         --apply file                                move files as listed in plan file (- for stdin), without database access
+         --explain                                   print query plans and timings of the search queries and exit
+         --stats file                                write timings and counters of the run to file (- for stdout)
+         --statsformat format   PLEX_STATSFORMAT     format of the --stats file, json or prometheus, env/default: {config.statsformat}
+         --profile file                              profile the run with cProfile and write the result to file
+         --watch                                     keep running, and run incrementally whenever Plex has changed its database
+         --watchinterval secs   PLEX_WATCHINTERVAL   seconds between checks for database changes, env/default: {config.watchinterval}
+         --watchquiet secs      PLEX_WATCHQUIET      seconds without database changes before a run starts, env/default: {config.watchquiet}
+         --journal file         PLEX_JOURNAL         journal of the moves of armed runs, for --resume and --undo, env/default: {config.journal}
+         --resume                                    finish the moves of an interrupted run, as listed in the journal
+         --undo                                      revert all moves of the last run, as listed in the journal
+         --shard K/N            PLEX_SHARD           only normalize shard K of N of the media items, env/default: {config.shard}
+         --shardby key          PLEX_SHARDBY         assign media items to shards by item or by first subdir below the base, env/default: {config.shardby}
+         --pathprefix dir       PLEX_PATHPREFIX      only normalize media files below dir (several allowed), env/default: {config.pathprefix}
+         --iops #               PLEX_IOPS            file system calls per second and device, 0 for unlimited, env/default: {config.iops}
+         --bandwidth bytes      PLEX_BANDWIDTH       bytes copied per second and device, e.g. 50M, 0 for unlimited, env/default: {config.bandwidth}
+         --lowpriority          PLEX_LOWPRIORITY     run with lowest CPU and I/O priority, env/default: {config.lowpriority}
+         --deviceorder          PLEX_DEVICEORDER     move media files grouped by device, in directory order, env/default: {config.deviceorder}
+         --changedfile file     PLEX_CHANGEDFILE     write the directories changed by the run to file (- for stdout), env/default: {config.changedfile}
+         --plexurl url          PLEX_URL             request partial scans of the changed directories from the Plex server at url, env/default: {config.plexurl}
+                                PLEX_TOKEN           Plex token for --plexurl, env/default: {"(set)" if config.plextoken else None}
+         --scanbatch #          PLEX_SCANBATCH       changed directories per library at most, merged into parent directories beyond, 0 for unlimited, env/default: {config.scanbatch}
+         --profiles names       PLEX_PROFILES        normalize these profiles of the config file in parallel (comma separated, or all), env/default: {config.profilenames}
+         --processes #          PLEX_PROCESSES       with --profiles, profiles normalized in parallel, 0 for all, env/default: {config.processes}
 
 {message}
 """, file=sys.stderr)
@@ -51,6 +146,15 @@ Arguments and Environment Variables:
         "debug":    False,
         "movies":   False,
         "series":   False,
+        "incremental":  False,
+        "plan":     None,
+        "apply":    None,
+        "explain":  False,
+        "stats":    None,
+        "profile":  None,
+        "watch":    False,
+        "resume":   False,
+        "undo":     False,
     }
 
     defaults = {
@@ -66,6 +170,35 @@ Arguments and Environment Variables:
         "serieslibrary":    "Serien",
         "seriessubdirs":    1,
         "ownseasonfolder":  False,
+
+        "moviestemplate":   None,
+        "seriestemplate":   None,
+
+        "snapshot":         "off",
+        "statefile":        "~/.plex.state",
+        "jobs":             1,
+        "asyncio":          False,
+        "mountjobs":        4,
+        "mkdirsfirst":      False,
+        "dirrename":        False,
+        "collisions":       "off",
+        "statsformat":      "json",
+        "watchinterval":    5,
+        "watchquiet":       60,
+        "journal":          None,
+        "shard":            None,
+        "shardby":          "item",
+        "pathprefix":       [],
+        "iops":             0,
+        "bandwidth":        0,
+        "lowpriority":      False,
+        "deviceorder":      False,
+        "changedfile":      None,
+        "plexurl":          None,
+        "plextoken":        None,
+        "scanbatch":        10,
+        "profilenames":     None,
+        "processes":        0,
     }
 
     try:
@@ -83,6 +216,16 @@ Arguments and Environment Variables:
         print(cfg_file+" contains invalid JSON:", err, file=sys.stderr)
         sys.exit(1)
 
+    # settings of several Plex servers, see profiles.py
+    profiles = config_from_file.pop("profiles", {})
+    if profiles.__class__ != dict \
+            or any(p.__class__ != dict for p in profiles.values()):
+        print(cfg_file+": profiles must be a dictionary of dictionaries.",
+              file=sys.stderr)
+        sys.exit(1)
+    if profile is not None:
+        config_from_file.update(profiles[profile])
+
     env_keys = {
         "rmdotfiles":       'PLEX_RMDOTFILES',
         "database":         'PLEX_DATABASE',
@@ -96,6 +239,35 @@ Arguments and Environment Variables:
         "serieslibrary":    'PLEX_SERIESLIBRARY',
         "seriessubdirs":    'PLEX_SERIESSUBDIRS',
         "ownseasonfolder":  'PLEX_OWNSEASONFOLDER',
+
+        "moviestemplate":   'PLEX_MOVIESTEMPLATE',
+        "seriestemplate":   'PLEX_SERIESTEMPLATE',
+
+        "snapshot":         'PLEX_SNAPSHOT',
+        "statefile":        'PLEX_STATEFILE',
+        "jobs":             'PLEX_JOBS',
+        "asyncio":          'PLEX_ASYNCIO',
+        "mountjobs":        'PLEX_MOUNTJOBS',
+        "mkdirsfirst":      'PLEX_MKDIRSFIRST',
+        "dirrename":        'PLEX_DIRRENAME',
+        "collisions":       'PLEX_COLLISIONS',
+        "statsformat":      'PLEX_STATSFORMAT',
+        "watchinterval":    'PLEX_WATCHINTERVAL',
+        "watchquiet":       'PLEX_WATCHQUIET',
+        "journal":          'PLEX_JOURNAL',
+        "shard":            'PLEX_SHARD',
+        "shardby":          'PLEX_SHARDBY',
+        "pathprefix":       'PLEX_PATHPREFIX',
+        "iops":             'PLEX_IOPS',
+        "bandwidth":        'PLEX_BANDWIDTH',
+        "lowpriority":      'PLEX_LOWPRIORITY',
+        "deviceorder":      'PLEX_DEVICEORDER',
+        "changedfile":      'PLEX_CHANGEDFILE',
+        "plexurl":          'PLEX_URL',
+        "plextoken":        'PLEX_TOKEN',
+        "scanbatch":        'PLEX_SCANBATCH',
+        "profilenames":     'PLEX_PROFILES',
+        "processes":        'PLEX_PROCESSES',
     }
 
     config_dict = {
@@ -109,6 +281,7 @@ Arguments and Environment Variables:
             config_dict[key] = os.environ[envkey]
 
     config = SimpleNamespace(**config_dict)
+    config.profiles = profiles
 
     # normalize types
     if config.rmdotfiles.__class__ != bool:
@@ -123,6 +296,26 @@ Arguments and Environment Variables:
         config.ownseasonfolder = str(
             config.ownseasonfolder
         ).lower() in ("true", "1", "yes")
+    if config.mkdirsfirst.__class__ != bool:
+        config.mkdirsfirst = str(
+            config.mkdirsfirst
+        ).lower() in ("true", "1", "yes")
+    if config.dirrename.__class__ != bool:
+        config.dirrename = str(
+            config.dirrename
+        ).lower() in ("true", "1", "yes")
+    if config.asyncio.__class__ != bool:
+        config.asyncio = str(
+            config.asyncio
+        ).lower() in ("true", "1", "yes")
+    if config.lowpriority.__class__ != bool:
+        config.lowpriority = str(
+            config.lowpriority
+        ).lower() in ("true", "1", "yes")
+    if config.deviceorder.__class__ != bool:
+        config.deviceorder = str(
+            config.deviceorder
+        ).lower() in ("true", "1", "yes")
     if config.seriessubdirs.__class__ != int:
         try:
             config.seriessubdirs = abs(int(config.seriessubdirs))
@@ -135,9 +328,64 @@ Arguments and Environment Variables:
         except ValueError:
             config.moviessubdirs = defaults["moviessubdirs"]
 
+    config.snapshot = str(config.snapshot).lower()
+    if config.snapshot not in SNAPSHOTS:
+        config.snapshot = defaults["snapshot"]
+
+    config.collisions = str(config.collisions).lower()
+    if config.collisions not in COLLISIONS:
+        config.collisions = defaults["collisions"]
+
+    config.statsformat = str(config.statsformat).lower()
+    if config.statsformat not in FORMATS:
+        config.statsformat = defaults["statsformat"]
+
+    config.shardby = str(config.shardby).lower()
+    if config.shardby not in shard.SHARDKEYS:
+        config.shardby = defaults["shardby"]
+
+    # no fallback to the default: all shards would move everything
+    if config.shard:
+        try:
+            config.shard = shard.parse(str(config.shard))
+        except ValueError as err:
+            usage(f"{err}.")
+
+    if config.pathprefix.__class__ != list:
+        # environment: separated like PATH
+        config.pathprefix = str(config.pathprefix).split(os.pathsep)
+
+    # clamped whatever the source, e.g. "jobs": 0 in the config file
+    for key, minimum in (("jobs", 1), ("mountjobs", 1), ("processes", 0),
+                         ("scanbatch", 0)):
+        try:
+            setattr(config, key, max(minimum, int(getattr(config, key))))
+        except (TypeError, ValueError):
+            setattr(config, key, defaults[key])
+
+    try:
+        iops = float(config.iops)
+    except (TypeError, ValueError):
+        iops = defaults["iops"]
+    # a negative limit is a typo rather than "unlimited"
+    if iops < 0:
+        usage("iops must not be negative.")
+    config.iops = iops
+
+    for key in ("watchinterval", "watchquiet"):
+        try:
+            setattr(config, key, max(0.0, float(getattr(config, key))))
+        except (TypeError, ValueError):
+            setattr(config, key, defaults[key])
+
+    try:
+        config.bandwidth = scheduler.parsesize(config.bandwidth)
+    except ValueError:
+        config.bandwidth = defaults["bandwidth"]
+
     try:
         opts, _ = getopt.getopt(
-            sys.argv[1:], "mb:l:s:oTB:L:S:OdD:rv", [
+            sys.argv[1:], "mb:l:s:oTB:L:S:OdD:rvj:", [
                 "armed",
                 "rmdotfiles",
                 "movies",
@@ -151,11 +399,45 @@ Arguments and Environment Variables:
                 "serieessubdirs=",
                 "ownseasonfolder",
                 "debug",
-                "database="
+                "database=",
+                "incremental",
+                "statefile=",
+                "jobs=",
+                "asyncio",
+                "mountjobs=",
+                "plan=",
+                "apply=",
+                "snapshot=",
+                "explain",
+                "mkdirsfirst",
+                "dirrename",
+                "collisions=",
+                "stats=",
+                "statsformat=",
+                "profile=",
+                "watch",
+                "watchinterval=",
+                "watchquiet=",
+                "journal=",
+                "shard=",
+                "shardby=",
+                "pathprefix=",
+                "iops=",
+                "bandwidth=",
+                "lowpriority",
+                "deviceorder",
+                "changedfile=",
+                "plexurl=",
+                "scanbatch=",
+                "profiles=",
+                "processes=",
+                "resume",
+                "undo"
             ])
     except getopt.GetoptError as err:
         usage(str(err)+".")
 
+    pathprefix = None
     for o, a in opts:
         if o == "--armed":
             config.armed = True
@@ -181,7 +463,7 @@ Arguments and Environment Variables:
         if o in ("-B", "--seriesbase"):
             config.seriesbase = a
         if o in ("-L", "--serieslibrary"):
-            config.seriesbase = a
+            config.serieslibrary = a
         if o in ("-S", "--serieessubdirs"):
             try:
                 config.seriessubdirs = abs(int(a))
@@ -194,11 +476,201 @@ Arguments and Environment Variables:
             config.debug = True
         if o in ("-D", "--database"):
             config.database = a
+        if o == "--incremental":
+            config.incremental = True
+        if o == "--statefile":
+            config.statefile = a
+        if o == "--mkdirsfirst":
+            config.mkdirsfirst = True
+        if o == "--dirrename":
+            config.dirrename = True
+        if o == "--collisions":
+            if a.lower() not in COLLISIONS:
+                usage(f"Argument to {o} must be one of {', '.join(COLLISIONS)}.")
+            config.collisions = a.lower()
+        if o in ("-j", "--jobs"):
+            try:
+                config.jobs = max(1, int(a))
+            except ValueError:
+                usage(f"Argument to {o} must be of type int.")
+        if o == "--asyncio":
+            config.asyncio = True
+        if o == "--mountjobs":
+            try:
+                config.mountjobs = max(1, int(a))
+            except ValueError:
+                usage(f"Argument to {o} must be of type int.")
+        if o == "--snapshot":
+            if a.lower() not in SNAPSHOTS:
+                usage(f"Argument to {o} must be one of {', '.join(SNAPSHOTS)}.")
+            config.snapshot = a.lower()
+        if o == "--explain":
+            config.explain = True
+        if o == "--plan":
+            config.plan = a
+        if o == "--apply":
+            config.apply = a
+        if o == "--stats":
+            config.stats = a
+        if o == "--statsformat":
+            if a.lower() not in FORMATS:
+                usage(f"Argument to {o} must be one of {', '.join(FORMATS)}.")
+            config.statsformat = a.lower()
+        if o == "--profile":
+            config.profile = a
+        if o == "--watch":
+            config.watch = True
+        if o in ("--watchinterval", "--watchquiet"):
+            try:
+                setattr(config, o[2:], max(0.0, float(a)))
+            except ValueError:
+                usage(f"Argument to {o} must be a number.")
+        if o == "--journal":
+            config.journal = a
+        if o == "--shard":
+            try:
+                config.shard = shard.parse(a)
+            except ValueError as err:
+                usage(f"{err}.")
+        if o == "--shardby":
+            if a.lower() not in shard.SHARDKEYS:
+                usage(f"Argument to {o} must be one of {', '.join(shard.SHARDKEYS)}.")
+            config.shardby = a.lower()
+        if o == "--iops":
+            try:
+                config.iops = float(a)
+            except ValueError:
+                usage(f"Argument to {o} must be a number.")
+            if config.iops < 0:
+                usage(f"Argument to {o} must not be negative.")
+        if o == "--bandwidth":
+            try:
+                config.bandwidth = scheduler.parsesize(a)
+            except ValueError:
+                usage(f"Argument to {o} must be a size, e.g. 50M.")
+        if o == "--lowpriority":
+            config.lowpriority = True
+        if o == "--deviceorder":
+            config.deviceorder = True
+        if o == "--changedfile":
+            config.changedfile = a
+        if o == "--plexurl":
+            config.plexurl = a
+        if o == "--profiles":
+            config.profilenames = a
+        if o == "--processes":
+            try:
+                config.processes = max(0, int(a))
+            except ValueError:
+                usage(f"Argument to {o} must be of type int.")
+        if o == "--scanbatch":
+            try:
+                config.scanbatch = max(0, int(a))
+            except ValueError:
+                usage(f"Argument to {o} must be of type int.")
+        if o == "--pathprefix":
+            # may be given several times, replacing config file and environment
+            pathprefix = (pathprefix or []) + [a]
+        if o == "--resume":
+            config.resume = True
+        if o == "--undo":
+            config.undo = True
         if o in ("-v", "--version"):
             print(VERSION)
             sys.exit(0)
 
-    if not config.movies and not config.series:
+    if config.resume or config.undo:
+        if config.resume and config.undo:
+            usage("--resume excludes --undo.")
+        if config.movies or config.series or config.plan or config.apply \
+                or config.explain or config.watch:
+            usage("--resume and --undo exclude -m, -T, --plan, --apply, --explain and --watch.")
+        if not config.journal:
+            usage("--resume and --undo require --journal.")
+    elif config.apply:
+        if config.movies or config.series or config.plan or config.explain \
+                or config.watch:
+            usage("--apply excludes -m, -T, --plan, --explain and --watch.")
+    elif not config.movies and not config.series:
         usage("Either -m or -T must be specified.")
+    elif config.explain and config.plan:
+        usage("--explain excludes --plan.")
+    elif config.watch and (config.plan or config.explain):
+        usage("--watch excludes --plan and --explain.")
+
+    if config.profilenames:
+        if config.plan or config.apply or config.explain or config.watch \
+                or config.resume or config.undo or config.profile:
+            usage("--profiles excludes --plan, --apply, --explain, --watch, --resume, --undo and --profile.")
+        if config.profilenames.__class__ != list:
+            config.profilenames = [
+                name.strip() for name in str(config.profilenames).split(",")
+                if name.strip()
+            ]
+        if config.profilenames == ["all"]:
+            config.profilenames = list(config.profiles)
+        for name in config.profilenames:
+            if name not in config.profiles:
+                usage(f"Profile {name!r} not found in the config file.")
+        if not config.profilenames:
+            usage("No profiles in the config file.")
+
+    if config.watch:
+        # passes only process media changed since the previous pass
+        config.incremental = True
+
+    if pathprefix is not None:
+        config.pathprefix = pathprefix
+    # from the config file, e.g. "journal": 5
+    for key in ("statefile", "journal", "changedfile"):
+        value = getattr(config, key)
+        if value is None and key != "statefile":
+            continue
+        if value.__class__ != str:
+            usage(f"{key} must be a file name.")
+    if any(prefix.__class__ != str for prefix in config.pathprefix):
+        usage("pathprefix must be a list of directories.")
+    config.pathprefix = [
+        os.path.normpath(os.path.expanduser(prefix))
+        for prefix in config.pathprefix if prefix
+    ]
+
+    if profile is not None:
+        # files written by each profile, unless given by the profile itself
+        for key in ("statefile", "journal", "changedfile"):
+            value = getattr(config, key)
+            if value and value != "-" and value != profiles[profile].get(key):
+                setattr(config, key, f"{value}.{profile}")
+
+    config.statefile = os.path.expanduser(config.statefile)
+    if config.journal:
+        config.journal = os.path.expanduser(config.journal)
+    if config.changedfile and config.changedfile != "-":
+        config.changedfile = os.path.expanduser(config.changedfile)
+
+    if config.plexurl and urllib.parse.urlsplit(
+            config.plexurl).scheme not in ("http", "https"):
+        usage("--plexurl must be an http or https URL.")
+
+    # default naming templates depend on -o and -O
+    if not config.moviestemplate:
+        config.moviestemplate = naming.MOVIESOWNFOLDER \
+            if config.ownmoviefolder else naming.MOVIES
+    if not config.seriestemplate:
+        config.seriestemplate = naming.SERIESOWNFOLDER \
+            if config.ownseasonfolder else naming.SERIES
+
+    # movieslibrary and serieslibrary may list several libraries, each with
+    # its own base directory, subdirs and template
+    try:
+        config.movieslibraries = _libraries(
+            config.movieslibrary, config.moviesbase, config.moviessubdirs,
+            config.moviestemplate)
+        config.serieslibraries = _libraries(
+            config.serieslibrary, config.seriesbase, config.seriessubdirs,
+            config.seriestemplate)
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
 
     return config
@@ -0,0 +1,204 @@
+"""Cross-Device Move Module for normalize-plex-files
+
+Hard links (see utils.movemedia()) only work within one filesystem. If a
+move crosses filesystems, e.g. because {config.moviessubdirs} maps into
+a different mount, the file has to be copied instead:
+- crossdevice() detects moves across filesystems, using a cache of the
+  st_dev of the directories involved,
+- copyfile() streams the data in large chunks, using os.copy_file_range()
+  or os.sendfile() where available, preserves permissions and times, and
+  verifies the size of the copy. The data is copied to a temporary file
+  next to the target (see partfile()), which only gets the target name
+  once complete - so a file under the target name is either complete or
+  not ours, and is never removed.
+The source file is only removed by the caller after copyfile() succeeded.
+If that never happened (e.g. the run was interrupted), same() recognizes
+the complete copy - or the hard link - on the next run.
+"""
+
+import contextlib
+import errno
+import os
+import shutil
+import time
+import scheduler
+import stats
+
+
+# number of bytes copied per system call
+CHUNKSIZE = 64 * 1024 * 1024
+
+# directory -> st_dev
+_devices: dict[str, int] = {}
+
+# errors indicating that a copy method is not supported for these files
+UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+               errno.ENOTSUP, errno.EBADF)
+
+
+def device(dir: str) -> int:
+    """returns the st_dev of directory {dir} (cached)."""
+    try:
+        return _devices[dir]
+    except KeyError:
+        dev = _devices[dir] = os.stat(dir).st_dev
+        return dev
+
+
+def clear() -> None:
+    """forgets the cached st_dev of all directories, e.g. before another
+    run in the same process (see watch.py)."""
+    _devices.clear()
+
+
+def crossdevice(old_file: str, new_file: str) -> bool:
+    """returns True if {old_file} and {new_file} are on different
+    filesystems, i.e. {old_file} cannot be hard linked to {new_file}."""
+    return device(os.path.dirname(old_file)) != device(os.path.dirname(new_file))
+
+
+def _copydata(src: int, dst: int, dirs: tuple[str, ...] = ()) -> int:
+    """copies all data from file descriptor {src} to file descriptor {dst},
+    returns the number of bytes copied. The bytes copied are throttled
+    per device of directories {dirs} (see scheduler.py)."""
+    offset = 0
+    chunksize = scheduler.chunksize(CHUNKSIZE)
+
+    for method in ("copy_file_range", "sendfile"):
+        if not hasattr(os, method):
+            continue
+        try:
+            while True:
+                if method == "copy_file_range":
+                    n = os.copy_file_range(src, dst, chunksize, offset, offset)
+                else:
+                    n = os.sendfile(dst, src, offset, chunksize)
+                if n == 0:
+                    return offset
+                offset += n
+                scheduler.transferred(n, dirs)
+        except OSError as e:
+            # fall back to the next method, unless data has been copied
+            if offset or e.errno not in UNSUPPORTED:
+                raise
+
+    # portable fallback: read and write
+    while True:
+        data = os.read(src, chunksize)
+        if not data:
+            return offset
+        offset += os.write(dst, data)
+        scheduler.transferred(len(data), dirs)
+
+
+def partfile(new_file: str) -> str:
+    """returns the name of the temporary file {new_file} is copied to."""
+    dir, name = os.path.split(new_file)
+    return os.path.join(dir, f".{name}.normalize-plex-files.part")
+
+
+def _publish(part: str, new_file: str) -> None:
+    """gives the complete copy {part} the name {new_file}, without
+    overwriting an existing {new_file}."""
+    try:
+        os.link(part, new_file)
+    except FileExistsError:
+        raise
+    except OSError:
+        # no hard links on this filesystem (e.g. SMB, FAT)
+        if os.path.lexists(new_file):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST),
+                                  new_file)
+        os.rename(part, new_file)
+    else:
+        os.unlink(part)
+
+
+def copyfile(old_file: str, new_file: str) -> tuple[int, float]:
+    """copies {old_file} to {new_file} including permissions and times,
+    by way of partfile(). Does not overwrite existing files. Removes the
+    incomplete copy on error.
+    Returns the number of bytes copied and the time it took in seconds."""
+    start = time.perf_counter()
+    stats.syscall("copy")
+    dirs = (os.path.dirname(old_file), os.path.dirname(new_file))
+    scheduler.op(dirs[1])
+
+    # move without overwriting
+    if os.path.lexists(new_file):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST),
+                              new_file)
+
+    part = partfile(new_file)
+    # left over by an interrupted copy
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(part)
+
+    src = os.open(old_file, os.O_RDONLY)
+    try:
+        size = os.fstat(src).st_size
+        dst = os.open(part, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            try:
+                copied = _copydata(src, dst, dirs)
+                os.fsync(dst)
+            finally:
+                os.close(dst)
+            shutil.copystat(old_file, part)
+            if copied != size or os.stat(part).st_size != size:
+                raise OSError(
+                    errno.EIO,
+                    f"size mismatch after copy ({copied} of {size} bytes)",
+                    new_file)
+            _publish(part, new_file)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(part)
+            raise
+    finally:
+        os.close(src)
+
+    return size, time.perf_counter() - start
+
+
+def transfer(old_file: str, new_file: str) -> tuple[int, float]:
+    """hard links {old_file} to {new_file}, or copies it with copyfile() if
+    the two are on different filesystems. Does not overwrite existing files.
+    Returns None for a hard link, otherwise the result of copyfile()."""
+    if crossdevice(old_file, new_file):
+        return copyfile(old_file, new_file)
+    stats.syscall("link")
+    scheduler.op(os.path.dirname(new_file))
+    try:
+        os.link(old_file, new_file)
+    except OSError as e:
+        # e.g. bind mounts of the same filesystem
+        if e.errno != errno.EXDEV:
+            raise
+        return copyfile(old_file, new_file)
+    return None
+
+
+def same(old_file: str, new_file: str) -> bool:
+    """returns True if {new_file} already is {old_file}: the same file (a
+    hard link), or a complete copy, i.e. of the same size and modification
+    time - copyfile() only sets the time after all data has been copied.
+    Used to finish moves interrupted before {old_file} was unlinked."""
+    stats.syscall("stat")
+    scheduler.op(os.path.dirname(new_file))
+    try:
+        old = os.stat(old_file)
+        new = os.stat(new_file)
+    except OSError:
+        return False
+    if (old.st_dev, old.st_ino) == (new.st_dev, new.st_ino):
+        return True
+    return old.st_dev != new.st_dev and old.st_size == new.st_size \
+        and old.st_mtime_ns == new.st_mtime_ns
+
+
+def throughput(size: int, seconds: float) -> str:
+    """returns a human readable summary of a copy of {size} bytes in
+    {seconds}."""
+    mib = size / (1024 * 1024)
+    return f"{mib:.1f} MiB in {seconds:.1f}s, {mib / max(seconds, 1e-6):.1f} MiB/s"
@@ -0,0 +1,117 @@
+"""Database Module for normalize-plex-files
+
+Opens the Plex database, either directly or - depending on
+{config.snapshot} - as a snapshot:
+- "off":      the live database is used directly,
+- "memory":   the live database is opened read-only and copied into memory,
+- "tempfile": the live database is opened read-only and copied into a
+              temporary file, which is removed when the connection is
+              closed (or on exit, if it never is).
+
+Using a snapshot, the live database is only locked while it is copied,
+all queries see one consistent state of the database, and indexes
+supporting the search queries can be added to the copy.
+"""
+
+import atexit
+import contextlib
+import os
+import pathlib
+import sqlite3
+import sys
+import tempfile
+from types import SimpleNamespace
+
+
+SNAPSHOTS = ("off", "memory", "tempfile")
+
+# (table, column) pairs the search queries join or filter on
+INDEXES = (
+    ("metadata_items", "library_section_id"),
+    ("metadata_items", "parent_id"),
+    ("media_items", "metadata_item_id"),
+    ("media_parts", "media_item_id"),
+    ("taggings", "metadata_item_id"),
+)
+
+
+# temporary snapshot files not removed yet
+_tempfiles: set[str] = set()
+
+
+def _remove(path: str) -> None:
+    _tempfiles.discard(path)
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+
+
+@atexit.register
+def _removeall() -> None:
+    for path in list(_tempfiles):
+        _remove(path)
+
+
+class _TempSnapshot(sqlite3.Connection):
+    """Connection to a snapshot in a temporary file, which is removed when
+    the connection is closed, so every pass of --watch does not leave a
+    copy of the database behind."""
+
+    path: str = None
+
+    def close(self) -> None:
+        super().close()
+        if self.path is not None:
+            _remove(self.path)
+            self.path = None
+
+    def __del__(self):
+        # e.g. a --watch pass aborted by an error before closing
+        self.close()
+
+
+def connect(config: SimpleNamespace) -> sqlite3.Connection:
+    """returns a connection to {config.database} or a snapshot of it.
+    Raises sqlite3.Error if the database cannot be opened or copied."""
+    if config.snapshot == "off":
+        return sqlite3.connect(config.database)
+
+    uri = pathlib.Path(os.path.abspath(config.database)).as_uri() + "?mode=ro"
+    live = sqlite3.connect(uri, uri=True)
+
+    if config.snapshot == "memory":
+        snapshot = sqlite3.connect(":memory:")
+    else:
+        fd, path = tempfile.mkstemp(prefix="normalize-plex-files-", suffix=".db")
+        os.close(fd)
+        _tempfiles.add(path)
+        snapshot = sqlite3.connect(path, factory=_TempSnapshot)
+        snapshot.path = path
+
+    if config.debug:
+        print(f"Copying database to {config.snapshot}.", file=sys.stderr)
+
+    try:
+        live.backup(snapshot)
+    except sqlite3.Error:
+        snapshot.close()
+        raise
+    finally:
+        live.close()
+
+    for table, column in INDEXES:
+        ensureindex(snapshot, table, column)
+
+    return snapshot
+
+
+def ensureindex(con: sqlite3.Connection, table: str, column: str) -> None:
+    """creates an index on {table}.{column} unless an index with {column}
+    as its first column exists already."""
+    for index in con.execute(f'PRAGMA index_list("{table}")').fetchall():
+        first = con.execute(f'PRAGMA index_info("{index[1]}")').fetchone()
+        if first is not None and first[2] == column:
+            return
+
+    con.execute(
+        f'CREATE INDEX "normalize_{table}_{column}" ON "{table}" ("{column}")'
+    )
@@ -0,0 +1,157 @@
+"""Directory Index Module for normalize-plex-files
+
+Lists every source directory only once per run (using os.scandir) and
+serves all further lookups from memory:
+- sidecars() finds all files belonging to a media file (the video file
+  itself and e.g. .srt or .nfo files with the same basename),
+- dotfiles() finds the dot-files to remove before a directory is removed,
+- empty() tells whether removing a directory can succeed at all,
+- exists() tells whether a file exists (see preflight.py),
+- entries() lists a whole directory (see dirrename.py).
+
+On network filesystems this saves one directory listing round trip per
+media file. Changes made by this application are reported back by
+movemedia() through added() and removed(), so the index stays valid for
+the rest of the run.
+
+The index may be used by several worker threads (see executor.py); a lock
+protects it, but directories are listed outside of the lock.
+"""
+
+import bisect
+import os
+import threading
+import scheduler
+import stats
+
+
+# directory -> sorted list of entry names
+_index: dict[str, list[str]] = {}
+_lock = threading.Lock()
+
+
+def _list(dir: str) -> None:
+    """lists {dir} into the index, unless already done."""
+    with _lock:
+        if dir in _index:
+            return
+
+    stats.syscall("scandir")
+    scheduler.op(dir)
+    try:
+        with os.scandir(dir) as it:
+            names = sorted(entry.name for entry in it)
+    except (FileNotFoundError, NotADirectoryError):
+        names = []
+
+    with _lock:
+        _index.setdefault(dir, names)
+
+
+def sidecars(old_file: str) -> list[str]:
+    """returns all files with basename {old_file} and arbitrary extensions,
+    like glob.glob(glob.escape(old_file)+'.*') does.
+
+    As basenames may contain dots themselves, entries are not grouped by
+    splitting at the first dot. Instead, the sorted entry list is searched
+    for all names starting with the basename followed by a dot; these are
+    adjacent in the sorted list."""
+    dir, name = os.path.split(old_file)
+    prefix = name + "."
+    _list(dir)
+
+    result = []
+    with _lock:
+        names = _index.get(dir, [])
+        for i in range(bisect.bisect_left(names, prefix), len(names)):
+            if not names[i].startswith(prefix):
+                break
+            result.append(os.path.join(dir, names[i]))
+
+    return result
+
+
+def dotfiles(dir: str) -> list[str]:
+    """returns all dot-files in {dir}, like
+    glob.glob(os.path.join(glob.escape(dir), '.??*')) does."""
+    _list(dir)
+
+    with _lock:
+        return [
+            os.path.join(dir, name) for name in _index.get(dir, [])
+            if name.startswith(".") and len(name) >= 3
+        ]
+
+
+def entries(dir: str) -> list[str]:
+    """returns all entries of {dir}, like glob.glob(os.path.join(
+    glob.escape(dir), '*')) plus dot-files does."""
+    _list(dir)
+
+    with _lock:
+        return [os.path.join(dir, name) for name in _index.get(dir, [])]
+
+
+def exists(file: str) -> bool:
+    """returns True if {file} exists, like os.path.lexists() does."""
+    dir, name = os.path.split(file)
+    _list(dir)
+
+    with _lock:
+        names = _index.get(dir, [])
+        i = bisect.bisect_left(names, name)
+        return i < len(names) and names[i] == name
+
+
+def empty(dir: str, dotfiles: bool = False) -> bool:
+    """returns True if {dir} has no entries, not counting the dot-files
+    found by dotfiles() if {dotfiles} is true."""
+    _list(dir)
+
+    with _lock:
+        for name in _index.get(dir, []):
+            if not (dotfiles and name.startswith(".") and len(name) >= 3):
+                return False
+
+    return True
+
+
+def added(file: str) -> None:
+    """records that {file} has been created. Directories not listed yet
+    are not listed because of this."""
+    dir, name = os.path.split(file)
+    with _lock:
+        names = _index.get(dir)
+        if names is not None:
+            i = bisect.bisect_left(names, name)
+            if i == len(names) or names[i] != name:
+                names.insert(i, name)
+
+
+def clear() -> None:
+    """forgets all directories listed, e.g. before another run in the
+    same process (see watch.py)."""
+    with _lock:
+        _index.clear()
+
+
+def renamed(old_dir: str, new_dir: str) -> None:
+    """records that directory {old_dir} has been renamed to {new_dir}."""
+    with _lock:
+        names = _index.pop(old_dir, None)
+        if names is not None:
+            _index[new_dir] = names
+    removed(old_dir)
+    added(new_dir)
+
+
+def removed(path: str) -> None:
+    """records that {path} (a file or a directory) has been removed."""
+    dir, name = os.path.split(path)
+    with _lock:
+        _index.pop(path, None)
+        names = _index.get(dir)
+        if names is not None:
+            i = bisect.bisect_left(names, name)
+            if i < len(names) and names[i] == name:
+                del names[i]
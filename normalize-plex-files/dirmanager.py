@@ -0,0 +1,264 @@
+"""Directory Manager Module for normalize-plex-files
+
+Creates the target directories of the moves. It remembers which
+directories exist already or have been created during the run, so each
+directory costs at most one mkdir per run, however many media files are
+moved into it. Missing parent directories (e.g. the series folder of a
+season folder) are created as well.
+
+With {config.mkdirsfirst}, a DirBatch creates all target directories of a
+run in one batch before any file is moved.
+
+Source directories emptied by the moves are removed at the end of the run
+by a Cleanup, see there.
+"""
+
+import collections
+import heapq
+import os
+import sys
+import threading
+from types import SimpleNamespace
+from typing import Callable, TextIO
+import dirindex
+import scheduler
+import stats
+
+
+# directories known to exist
+_known: set[str] = set()
+_lock = threading.Lock()
+
+
+def makedirs(dir: str, config: SimpleNamespace, err: TextIO = None) -> bool:
+    """Creates the directory {dir} and missing parent directories when
+    {config.armed} is true. Already existing directories are not an error,
+    other errors are written to {err} (default: stderr).
+    Returns False if {dir} could not be created."""
+    if not config.armed:
+        return True
+
+    with _lock:
+        if dir in _known:
+            return True
+
+    stats.syscall("mkdir")
+    scheduler.op(dir)
+    try:
+        os.mkdir(dir)
+    except FileExistsError:
+        pass
+    except FileNotFoundError:
+        # parent missing: create it first, then retry
+        parent = os.path.dirname(dir)
+        if parent == dir or not makedirs(parent, config, err):
+            return False
+        stats.syscall("mkdir")
+        scheduler.op(dir)
+        try:
+            os.mkdir(dir)
+        except FileExistsError:
+            pass
+        except Exception as e:
+            print(e, file=err or sys.stderr)
+            stats.count("errors")
+            return False
+        else:
+            dirindex.added(dir)
+    except Exception as e:
+        print(e, file=err or sys.stderr)
+        stats.count("errors")
+        return False
+    else:
+        dirindex.added(dir)
+
+    with _lock:
+        _known.add(dir)
+    return True
+
+
+def removed(dir: str) -> None:
+    """records that {dir} has been removed."""
+    with _lock:
+        _known.discard(dir)
+
+
+def clear() -> None:
+    """forgets all known directories, e.g. before another run in the same
+    process (see watch.py)."""
+    with _lock:
+        _known.clear()
+
+
+def removedir(dir: str, config: SimpleNamespace,
+              out: TextIO = None, err: TextIO = None) -> bool:
+    """Tries to remove the old directory {dir} after media files have been
+    moved out of it, when {config.armed} is true.
+    Forcefully removes dot-files from {dir} to allow for directory removal
+    if {config.rmdotfiles} is true.
+    Messages are written to {out} and errors to {err} (default: stdout and
+    stderr). Returns True if {dir} has been removed."""
+    if not config.armed:
+        return False
+
+    out = out or sys.stdout
+    err = err or sys.stderr
+
+    # nothing to do if files other than (removable) dot-files are left
+    if not dirindex.empty(dir, config.rmdotfiles):
+        return False
+
+    # prereq: remove dot files in dir, if config.rmdotfiles
+    if config.rmdotfiles:
+        dotfiles = dirindex.dotfiles(dir)
+        for dotfile in dotfiles:
+            print(f"removing {dotfile}", file=out)
+            stats.syscall("unlink")
+            scheduler.op(dir)
+            try:
+                os.unlink(dotfile)
+            except Exception as e:
+                print(e, file=err)
+                stats.count("errors")
+            else:
+                dirindex.removed(dotfile)
+    # actual rmdir:
+    # ignore if not empty (e.g. files added since the directory was listed)
+    stats.syscall("rmdir")
+    scheduler.op(dir)
+    try:
+        os.rmdir(dir)
+    except OSError:
+        return False  # not empty (expected)
+    except Exception as e:
+        print(e, file=err)  # real error
+        stats.count("errors")
+        return False
+    else:
+        dirindex.removed(dir)
+        removed(dir)
+        print(f"removed {dir}", file=out)
+        return True
+
+
+class Cleanup:
+    """Removes the source directories emptied by the moves of a run.
+
+    Instead of trying to remove the source directory after every single
+    move, Cleanup counts the pending moves out of each directory (see
+    planned() and finished()). At the end of the run, run() sweeps the
+    dot-files of each directory and removes it once, if all moves out of it
+    succeeded. This is done bottom-up, so parent directories emptied this
+    way are removed as well - but never a directory that contains the new
+    location of a move (so base directories and retained subdirectories
+    are never removed), and never above the library base directory of the
+    move - or above the directory to remove itself, if the move is not
+    below any library base directory (e.g. from a plan or a journal)."""
+
+    def __init__(self, config: SimpleNamespace):
+        self.config = config
+        self.bases = [
+            os.path.normpath(library.base)
+            for library in config.movieslibraries + config.serieslibraries
+        ]
+        self.lock = threading.Lock()
+        # directory -> number of moves out of it not finished yet
+        self.pending = collections.Counter()
+        # directories with failed moves
+        self.failed = set()
+        # directory -> deepest parent directory that must not be removed
+        self.keep = {}
+
+    def planned(self, move) -> None:
+        """records that {move} is going to be executed."""
+        if move.rmdir is None:
+            return
+        # shared by all directories below the same retained subdir
+        keep = sys.intern(max(
+            os.path.commonpath([move.rmdir, os.path.dirname(move.new_file)]),
+            self._bound(move.rmdir), key=len
+        ))
+        with self.lock:
+            self.pending[move.rmdir] += 1
+            if len(keep) > len(self.keep.get(move.rmdir, "")):
+                self.keep[move.rmdir] = keep
+
+    def _bound(self, dir: str) -> str:
+        """returns the library base directory of {dir}, or the parent of
+        {dir} if it is not below a library base directory."""
+        bases = [
+            base for base in self.bases
+            if dir == base or dir.startswith(os.path.join(base, ""))
+        ]
+        return max(bases, key=len) if bases else os.path.dirname(dir)
+
+    def finished(self, move, success: bool) -> None:
+        """records that {move} has been executed."""
+        if move.rmdir is None:
+            return
+        with self.lock:
+            self.pending[move.rmdir] -= 1
+            if not success:
+                self.failed.add(move.rmdir)
+
+    def run(self, out: TextIO = None, err: TextIO = None) -> None:
+        """removes all emptied directories, deepest first."""
+        with stats.timed("cleanup"):
+            self._run(out, err)
+
+    def _run(self, out, err):
+        heap = []   # (-depth, dir, keep)
+
+        def push(dir, keep):
+            if dir.startswith(os.path.join(keep, "")) \
+                    and dir not in self.failed and self.pending[dir] <= 0:
+                heapq.heappush(heap, (-dir.count(os.sep), dir, keep))
+
+        for dir, keep in self.keep.items():
+            push(dir, keep)
+
+        done = set()
+        while heap:
+            _, dir, keep = heapq.heappop(heap)
+            if dir in done:
+                continue
+            done.add(dir)
+            if removedir(dir, self.config, out, err):
+                push(os.path.dirname(dir), keep)
+
+        self.pending.clear()
+        self.failed.clear()
+        self.keep.clear()
+
+
+class DirBatch:
+    """Collects all jobs submitted, creates all their target directories in
+    one batch, and only then hands the jobs on to {executor}. Can be used in
+    place of an executor.MoveExecutor."""
+
+    def __init__(self, executor, config: SimpleNamespace):
+        self.executor = executor
+        self.config = config
+        self.jobs = []
+
+    def submit(self, moves: list, callback: Callable[[bool], None] = None) -> None:
+        """collects a job, see executor.MoveExecutor.submit()."""
+        self.jobs.append((moves, callback))
+
+    def close(self) -> None:
+        """creates all target directories, then submits all jobs to the
+        executor and closes it."""
+        # sorted, so parents are created before their children
+        with stats.timed("mkdir"):
+            for dir in sorted({
+                move.mkdir
+                for moves, _ in self.jobs for move in moves
+                if move.mkdir is not None
+            }):
+                makedirs(dir, self.config)
+
+        for moves, callback in self.jobs:
+            self.executor.submit(moves, callback)
+        self.jobs.clear()
+
+        self.executor.close()
@@ -0,0 +1,195 @@
+"""Directory Rename Module for normalize-plex-files
+
+Moves whole directories at once. When a movie folder or a season folder
+maps one-to-one onto a new folder, moving its files one by one costs a
+mkdir of the new folder, a link and an unlink per file (video, subtitles,
+.nfo, ...) and an rmdir of the old folder. Renaming the folder itself is a
+single rename, followed by renames of the files inside the renamed folder
+whose names change - none at all if only the folder name changes, as with
+many series.
+
+With {config.dirrename}, a DirRename collects all jobs of a run and
+renames a source directory S to a new directory T if
+- all moves out of S go to T, remove S afterwards, and create T,
+- no other move goes into S or T, and neither is below the other,
+- every entry of S is a file of one of these moves (so nothing else is
+  moved along, and S would have been removed anyway),
+- T does not exist yet, and S and T are on the same filesystem.
+Otherwise the files are moved one by one as usual. The rename is recorded
+in the journal like a file move, so --resume and --undo handle it.
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+from typing import Callable
+import crossmove
+import dirindex
+import dirmanager
+import journal
+import scheduler
+import stats
+from plan import Move
+
+
+def _candidates(jobs: list) -> dict[str, str]:
+    """returns the source directories of {jobs} that can be renamed as a
+    whole, with their new directory (see module documentation), checked on
+    the moves only."""
+    # source directory -> target directory
+    targets = {}
+    # directories moved into, and source directories not to be renamed
+    into = set()
+    blocked = set()
+    for moves, _ in jobs:
+        for move in moves:
+            source = os.path.dirname(move.old_file)
+            target = os.path.dirname(move.new_file)
+            into.add(target)
+            if move.rmdir != source or move.mkdir != target \
+                    or targets.get(source, target) != target:
+                blocked.add(source)
+            targets[source] = target
+
+    # each target directory must have a single source directory
+    sources = {}
+    for source, target in targets.items():
+        sources.setdefault(target, []).append(source)
+
+    return {
+        source: target
+        for source, target in targets.items()
+        if source not in blocked and source not in into
+        and target not in targets and len(sources[target]) == 1
+        and source != target
+        and not target.startswith(os.path.join(source, ""))
+        and not source.startswith(os.path.join(target, ""))
+    }
+
+
+def _complete(source: str, moves: list[Move]) -> bool:
+    """returns True if every entry of directory {source} is a file of one
+    of {moves}."""
+    entries = set(dirindex.entries(source))
+    if not entries:
+        return False
+    for move in moves:
+        entries.difference_update(dirindex.sidecars(move.old_file))
+    return not entries
+
+
+def rename(source: str, target: str, config: SimpleNamespace,
+           out=None, err=None) -> bool:
+    """renames directory {source} to {target} when {config.armed} is true,
+    creating the parent directory of {target} if missing. Does not replace
+    an existing {target}. Messages are written to {out} and errors to {err}
+    (default: stdout and stderr). Returns False if {source} has not been
+    renamed."""
+    out = out or sys.stdout
+    err = err or sys.stderr
+
+    # os.rename() would replace an empty target directory
+    if os.path.lexists(target):
+        return False
+
+    if not config.armed:
+        print(f"""would move directory:
+{source}
+{target}
+""", file=out)
+        return True
+
+    if not dirmanager.makedirs(os.path.dirname(target), config, err):
+        return False
+    # across filesystems: moved file by file instead
+    if crossmove.device(source) != crossmove.device(os.path.dirname(target)):
+        return False
+
+    journal.intend([(source, target)])
+    stats.syscall("rename")
+    scheduler.op(source)
+    try:
+        with stats.timed("link"):
+            os.rename(source, target)
+    except OSError:
+        # e.g. no permission: moved file by file instead
+        journal.failed(source, target)
+        return False
+
+    dirindex.renamed(source, target)
+    dirmanager.removed(source)
+    journal.done(source, target)
+    stats.count("dirrenames")
+    print(f"moved directory {source} -> {target}", file=out)
+    return True
+
+
+class DirRename:
+    """Collects all jobs submitted, renames the source directories that map
+    one-to-one onto a new directory (see module documentation), and hands
+    the jobs on to {executor}, with the moves of renamed directories
+    changed to renames inside the new directory. Can be used in place of
+    an executor.MoveExecutor."""
+
+    def __init__(self, executor, config: SimpleNamespace):
+        self.executor = executor
+        self.config = config
+        self.jobs = []
+        # removes the parents of the renamed directories, if emptied
+        self.cleanup = dirmanager.Cleanup(config)
+
+    def submit(self, moves: list[Move],
+               callback: Callable[[bool], None] = None) -> None:
+        """collects a job, see executor.MoveExecutor.submit()."""
+        self.jobs.append((moves, callback))
+
+    def close(self) -> None:
+        """renames the directories, then submits all jobs to the executor
+        and closes it."""
+        candidates = _candidates(self.jobs)
+
+        moved = {}
+        for moves, _ in self.jobs:
+            for move in moves:
+                source = os.path.dirname(move.old_file)
+                if source in candidates:
+                    moved.setdefault(source, []).append(move)
+
+        # sorted, so renames are done in directory order
+        renamed = {
+            source: candidates[source]
+            for source in sorted(moved)
+            if _complete(source, moved[source])
+            and rename(source, candidates[source], self.config)
+        }
+
+        for source, target in renamed.items():
+            # the new name's directory is {target}, see Cleanup.planned()
+            move = Move(source, os.path.join(target, ""), None,
+                        os.path.dirname(source))
+            self.cleanup.planned(move)
+            self.cleanup.finished(move, True)
+
+        for moves, callback in self.jobs:
+            self.executor.submit([
+                inside for inside in (
+                    self._inside(move, renamed) for move in moves
+                ) if inside is not None
+            ], callback)
+        self.jobs.clear()
+
+        self.executor.close()
+        self.cleanup.run()
+
+    @staticmethod
+    def _inside(move: Move, renamed: dict[str, str]) -> Move:
+        """returns {move}, or the rename inside the new directory if its
+        source directory has been renamed - None if the name does not
+        change, so nothing is moved (or journaled) at all."""
+        source, name = os.path.split(move.old_file)
+        if source not in renamed:
+            return move
+        old_file = os.path.join(renamed[source], name)
+        if old_file == move.new_file:
+            return None
+        return Move(old_file, move.new_file)
@@ -0,0 +1,146 @@
+"""Executor Module for normalize-plex-files
+
+Runs the moves of media files, either one after another (config.jobs == 1)
+or on a bounded pool of config.jobs worker threads. Source directories
+emptied by the moves are removed when the executor is closed.
+
+Moves are submitted in jobs, one job per media item. Jobs sharing a source
+or target directory are run in the order they have been submitted, so that
+directory creation and removal in movemedia() keep working as in a
+sequential run. Output and results of the jobs are reported in submission
+order, regardless of the order the jobs actually finish in.
+"""
+
+import collections
+import concurrent.futures
+import io
+import os
+import sys
+from types import SimpleNamespace
+from typing import Callable
+import utils
+import dirindex
+import dirmanager
+import journal
+import stats
+from plan import Move
+
+
+# maximum number of jobs submitted but not yet reported, per worker thread
+BACKLOG = 16
+
+
+class MoveExecutor:
+    """Executes move jobs, see module documentation."""
+
+    def __init__(self, config: SimpleNamespace):
+        self.config = config
+        self.pool = None
+        if config.jobs > 1:
+            self.pool = concurrent.futures.ThreadPoolExecutor(config.jobs)
+        # directory -> future of the job submitted last touching it
+        self.last = {}
+        # submitted jobs not reported yet: (future, callback, directories)
+        self.pending = collections.deque()
+        self.cleanup = dirmanager.Cleanup(config)
+
+    def submit(self, moves: list[Move],
+               callback: Callable[[bool], None] = None) -> None:
+        """submits a job processing all {moves}: creates directory
+        {move.mkdir} and moves the files with utils.movemedia(). Directory
+        {move.rmdir} is removed by close(), if emptied. When the job has been
+        reported, {callback} is called in the submitting thread with True if
+        all moves of the job succeeded."""
+        for move in moves:
+            self.cleanup.planned(move)
+
+        if self.pool is None:
+            success = self._run(moves, sys.stdout, sys.stderr)
+            if callback:
+                callback(success)
+            return
+
+        dirs = set()
+        for move in moves:
+            dirs.add(os.path.dirname(move.old_file))
+            dirs.add(os.path.dirname(move.new_file))
+            dirs.update(
+                dir for dir in (move.mkdir, move.rmdir) if dir is not None
+            )
+
+        predecessors = {self.last[dir] for dir in dirs if dir in self.last}
+        future = self._start(moves, predecessors)
+        for dir in dirs:
+            self.last[dir] = future
+
+        self.pending.append((future, callback, dirs))
+
+        # report finished jobs, and limit the number of pending jobs
+        while self.pending and (
+            self.pending[0][0].done()
+            or len(self.pending) > BACKLOG * self.config.jobs
+        ):
+            self._report()
+
+    def close(self) -> None:
+        """waits for all submitted jobs and reports them, then removes the
+        emptied source directories."""
+        while self.pending:
+            self._report()
+        if self.pool is not None:
+            self.pool.shutdown()
+        self.last.clear()
+        self.cleanup.run()
+
+    def _start(self, moves, predecessors) -> concurrent.futures.Future:
+        """starts a job once all jobs {predecessors} are done, returns the
+        future of its (success, output, errors) result."""
+        return self.pool.submit(self._work, moves, predecessors)
+
+    def _run(self, moves, out, err) -> bool:
+        if self.config.armed:
+            # moves to the same name are skipped, see utils.movemedia()
+            journal.intend([
+                (file, move.new_file + file[len(move.old_file):])
+                for move in moves if move.old_file != move.new_file
+                for file in dirindex.sidecars(move.old_file)
+            ])
+
+        success = True
+        for move in moves:
+            moved = True
+            if move.mkdir is not None:
+                with stats.timed("mkdir"):
+                    moved = dirmanager.makedirs(move.mkdir, self.config, err)
+            moved = moved and utils.movemedia(move.old_file, move.new_file,
+                                              self.config, out, err)
+            self.cleanup.finished(move, moved)
+            if not moved:
+                success = False
+        return success
+
+    def _work(self, moves, predecessors):
+        # jobs are dequeued in submission order, so predecessors have
+        # already been started by other workers and cannot deadlock us
+        concurrent.futures.wait(predecessors)
+        out = io.StringIO()
+        err = io.StringIO()
+        try:
+            success = self._run(moves, out, err)
+        except Exception as e:
+            print(e, file=err)
+            stats.count("errors")
+            success = False
+        return success, out.getvalue(), err.getvalue()
+
+    def _report(self):
+        future, callback, dirs = self.pending.popleft()
+        success, out, err = future.result()
+        # forget finished jobs, so memory does not grow with the library
+        for dir in dirs:
+            if self.last.get(dir) is future:
+                del self.last[dir]
+        sys.stdout.write(out)
+        sys.stderr.write(err)
+        if callback:
+            callback(success)
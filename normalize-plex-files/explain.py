@@ -0,0 +1,34 @@
+"""Explain Module for normalize-plex-files
+
+Implements --explain: prints the query plans SQLite chooses for the search
+queries, and the time it takes to execute them and to fetch all rows.
+This helps to spot performance regressions, e.g. after Plex changed its
+database schema.
+"""
+
+import sqlite3
+import time
+
+
+def explain(con: sqlite3.Connection, name: str, query: str, params: dict) -> None:
+    """prints the query plan of {query} executed with {params}, then
+    executes it and prints the timings."""
+    print(f"{name}:")
+    print("QUERY PLAN")
+
+    # rows are (id, parent, notused, detail), parents precede their children
+    depth = {0: 0}
+    for id, parent, _, detail in con.execute("EXPLAIN QUERY PLAN " + query, params):
+        depth[id] = depth.get(parent, 0) + 1
+        print("  " * depth[id] + detail)
+
+    start = time.perf_counter()
+    cur = con.execute(query, params)
+    first = cur.fetchone()
+    executed = time.perf_counter()
+    rows = 0 if first is None else 1 + sum(1 for _ in cur)
+    fetched = time.perf_counter()
+
+    print(f"first row: {executed - start:.3f}s")
+    print(f"all {rows} rows: {fetched - start:.3f}s")
+    print()
@@ -0,0 +1,277 @@
+"""Journal Module for normalize-plex-files
+
+Keeps a write-ahead journal of the file moves of an armed run in
+{config.journal}, so an interrupted run (reboot, NAS hiccup) can be
+finished with --resume, and a whole run can be reverted with --undo -
+both without querying the Plex database again.
+
+The journal is in JSON Lines format:
+    {"begin": <time>}               start of a run
+    {"intent": [<old>, <new>]}      file <old> is going to be moved to <new>
+    {"done": [<old>, <new>]}        file <old> has been moved to <new>
+    {"failed": [<old>, <new>]}      file <old> has not been moved at all
+    {"end": <time>}                 end of the run
+The intents of a job (all files of a media item, see executor.py) are
+written and fsynced together before the first file is touched. "done"
+records are not fsynced on their own but with the next batch of intents:
+a lost "done" record only means that --resume checks that move again.
+
+On --resume, every intent without "done" record is checked on disk:
+- only <old> exists: the move is replayed,
+- both exist as the same file (hard linked), or <new> is a complete copy
+  (see crossmove.same()): <old> is unlinked,
+- both exist otherwise: <new> is not ours, as a copy only gets its name
+  once complete (see crossmove.copyfile()), so it is left for the user
+  to check,
+- only <new> exists: the move had completed.
+Incomplete copies left over (see crossmove.partfile()) are removed.
+On --undo, all moves of the run are reverted the same way, in reverse
+order, including unfinished ones.
+Intents may also name directories renamed as a whole (see dirrename.py);
+these are renamed again instead of linked.
+
+Journal functions are called by the modules moving files and do nothing
+unless a journal has been opened with begin().
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from typing import Iterator, TextIO
+import crossmove
+import dirmanager
+from plan import Move
+
+
+_f: TextIO = None
+_lock = threading.Lock()
+
+
+def read(file: str) -> Iterator[dict]:
+    """yields the records of journal {file}. A truncated last line (crash
+    while writing) is ignored.
+    Raises ValueError on malformed lines."""
+    with open(file, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            try:
+                record = json.loads(line)
+            except json.decoder.JSONDecodeError as err:
+                if line.endswith("\n"):
+                    raise ValueError(f"{file}, line {lineno}: {err}")
+                continue
+            if not isinstance(record, dict):
+                raise ValueError(f"{file}, line {lineno}: not a record")
+            for name in ("intent", "done", "failed"):
+                if name in record and not (
+                    isinstance(record[name], list)
+                    and len(record[name]) == 2
+                    and all(isinstance(path, str) for path in record[name])
+                ):
+                    raise ValueError(f"{file}, line {lineno}: {name} must "
+                                     "be a list of two file names")
+            yield record
+
+
+def unfinished(file: str) -> bool:
+    """returns True if journal {file} contains a run that has not ended
+    after moving files."""
+    try:
+        records = list(read(file))
+    except FileNotFoundError:
+        return False
+    return bool(records) and "end" not in records[-1] \
+        and any("intent" in record for record in records)
+
+
+def begin(file: str) -> None:
+    """starts a new journal {file}, replacing an old one."""
+    global _f
+    _f = open(file, "w", encoding="utf-8")
+    _write({"begin": time.time()}, sync=True)
+
+
+def _write(record: dict, sync: bool = False) -> None:
+    _f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+             + "\n")
+    _f.flush()
+    if sync:
+        os.fsync(_f.fileno())
+
+
+def intend(moves: list[tuple[str, str]]) -> None:
+    """records that the files of {moves} ((old, new) tuples) are going to
+    be moved, with one fsync for all of them."""
+    if _f is None or not moves:
+        return
+    with _lock:
+        for old, new in moves:
+            _write({"intent": [old, new]})
+        os.fsync(_f.fileno())
+
+
+def done(old: str, new: str) -> None:
+    """records that file {old} has been moved to {new}."""
+    if _f is None:
+        return
+    with _lock:
+        _write({"done": [old, new]})
+
+
+def failed(old: str, new: str) -> None:
+    """records that file {old} has not been moved to {new}, and was left
+    untouched, so the move is neither finished nor reverted."""
+    if _f is None:
+        return
+    with _lock:
+        _write({"failed": [old, new]})
+
+
+def end() -> None:
+    """records the end of the run and closes the journal."""
+    global _f
+    if _f is None:
+        return
+    with _lock:
+        _write({"end": time.time()}, sync=True)
+        _f.close()
+        _f = None
+
+
+def _exists(file: str) -> bool:
+    return os.path.lexists(file)
+
+
+def _alias(old: str, new: str) -> bool:
+    """returns True if {old} and {new} name the same directory entry, e.g.
+    the same path, or names differing in case on a case-insensitive
+    filesystem - unlike two hard links of one file, which are two
+    entries."""
+    if old == new or os.path.realpath(old) == os.path.realpath(new):
+        return True
+    try:
+        return os.path.samefile(old, new) \
+            and (os.path.isdir(old) or os.lstat(old).st_nlink < 2)
+    except OSError:
+        return False
+
+
+def _removeparts(old: str, new: str, err: TextIO) -> None:
+    """removes the incomplete copies of an interrupted cross-filesystem
+    move between {old} and {new}, in either direction."""
+    for file in (old, new):
+        part = crossmove.partfile(file)
+        try:
+            os.unlink(part)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(e, file=err)
+        else:
+            print(f"removed incomplete copy {part}", file=err)
+
+
+def _finish(old: str, new: str, config: SimpleNamespace,
+            out: TextIO, err: TextIO, undo: bool = False) -> bool:
+    """completes the interrupted move of file {old} to {new}, see module
+    documentation. If {undo}, {old} is the new name of a move to be
+    reverted. Returns True if {old} has been moved to {new}.
+    A move of a file to itself (e.g. in a hand-edited journal) is skipped,
+    as unlinking the "old" name would remove the only copy."""
+    if _alias(old, new):
+        print(f"{old} and {new} are the same file, skipped", file=err)
+        return True
+    if config.armed:
+        _removeparts(old, new, err)
+    if _exists(old) and _exists(new):
+        if crossmove.same(old, new):
+            action = "unlinking"
+        else:
+            print(f"{old} and {new} both exist, please check", file=err)
+            return False
+    elif _exists(old):
+        action = "moving"
+    elif _exists(new):
+        return True
+    else:
+        print(f"{old} and {new} are both missing", file=err)
+        return False
+
+    verb = "revert" if undo else "finish"
+    if not config.armed:
+        print(f"would {verb} by {action}: {old} -> {new}", file=out)
+        return True
+
+    print(f"{verb}ing by {action}: {old} -> {new}", file=out)
+    try:
+        if action == "moving":
+            if not dirmanager.makedirs(os.path.dirname(new), config, err):
+                return False
+            if os.path.isdir(old) and not os.path.islink(old):
+                # a directory renamed as a whole, see dirrename.py
+                os.rename(old, new)
+                return True
+            crossmove.transfer(old, new)
+        os.unlink(old)
+    except OSError as e:
+        print(e, file=err)
+        return False
+    return True
+
+
+def _replay(config: SimpleNamespace, undo: bool) -> None:
+    """finishes (resume) or reverts (undo) the run in {config.journal}."""
+    try:
+        records = list(read(config.journal))
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    # intents in order, and the moves done
+    intents = {}
+    completed = set()
+    for record in records:
+        if "intent" in record:
+            intents.setdefault(tuple(record["intent"]), None)
+        elif "done" in record:
+            completed.add(tuple(record["done"]))
+        elif "failed" in record:
+            intents.pop(tuple(record["failed"]), None)
+
+    if undo:
+        # revert done and unfinished moves, latest first
+        moves = [(new, old) for old, new in reversed(intents)]
+    else:
+        moves = [move for move in intents if move not in completed]
+
+    out, err = sys.stdout, sys.stderr
+    cleanup = dirmanager.Cleanup(config)
+    failed = 0
+    for old, new in moves:
+        move = Move(old, new, None, os.path.dirname(old))
+        cleanup.planned(move)
+        success = _finish(old, new, config, out, err, undo)
+        cleanup.finished(move, success)
+        if not success:
+            failed += 1
+
+    cleanup.run(out, err)
+
+    if failed:
+        print(f"{failed} of {len(moves)} moves could not be finished, "
+              f"journal kept in {config.journal}.", file=err)
+        sys.exit(1)
+    if config.armed:
+        os.unlink(config.journal)
+
+
+def resume(config: SimpleNamespace) -> None:
+    """finishes the unfinished moves of the run in {config.journal}."""
+    _replay(config, undo=False)
+
+
+def undo(config: SimpleNamespace) -> None:
+    """reverts all moves of the run in {config.journal}."""
+    _replay(config, undo=True)
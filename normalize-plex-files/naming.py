@@ -0,0 +1,246 @@
+"""Naming Module for normalize-plex-files
+
+Computes the new names of media files from naming templates, which can be
+configured with {config.moviestemplate} and {config.seriestemplate}.
+
+A template is a str.format() string with the fields of MOVIEFIELDS or
+SERIESFIELDS, e.g. "{title} ({year})" or "{season:02}x{episode:02}", and
+additionally:
+- "/" separates folders from the file name, e.g.
+  "{series} ({year})/Season {season}/{season:02}x{episode:02} {title}".
+  Each folder name and the file name is sanitized separately with
+  utils.sanitize_filename(), so a "/" in a field value does not create a
+  folder,
+- "[...]" marks an optional part, which is omitted if any field in it is
+  None or empty, e.g. "[ {{edition-{edition}}}]",
+- "{{", "}}", "[[" and "]]" are literal braces and brackets.
+
+Templates are compiled once: they are parsed and checked on startup, and
+parts without fields are formatted in advance. Folder names are memoized,
+as e.g. all episodes of a season share the same series and season folder
+names.
+"""
+
+import functools
+import os
+import string
+import utils
+
+
+# fields available in movies templates, with sample values to check them
+MOVIEFIELDS = {
+    "title":        "Casino Royale",
+    "year":         1967,
+    "edition":      "Director's Cut",
+    "db_ref":       "tmdb-12208",
+    "width":        720,
+    "height":       336,
+    "resolution":   " [720x336]",   # see utils.resolutionstring()
+    "part":         " - part1",     # empty unless the movie has several parts
+}
+
+# fields available in series templates, with sample values to check them
+SERIESFIELDS = {
+    "series":       "Doctor Who",
+    "year":         2005,
+    "db_ref":       "tvdb-78804",
+    "season":       1,
+    "episode":      1,
+    "title":        "Rose",
+    "width":        1920,
+    "height":       1080,
+    "resolution":   " [1920x1080]",
+    "part":         " - part1",
+}
+
+# default templates, depending on {config.ownmoviefolder} and
+# {config.ownseasonfolder}
+MOVIES = \
+    "{title} ({year})[ {{edition-{edition}}}][ {{{db_ref}}}]{resolution}{part}"
+MOVIESOWNFOLDER = \
+    "{title} ({year})[ {{edition-{edition}}}][ {{{db_ref}}}]/" \
+    "{title} ({year}){resolution}{part}"
+SERIES = \
+    "{series} ({year})[ {{{db_ref}}}]/" \
+    "{season:02}x{episode:02} {series} - {title}{resolution}{part}"
+SERIESOWNFOLDER = \
+    "{series} ({year})[ {{{db_ref}}}]/Season {season}/" \
+    "{season:02}x{episode:02} {series} - {title}{resolution}{part}"
+
+# number of folder names memoized per folder level
+CACHESIZE = 4096
+
+
+def _split(template: str) -> list[list[tuple[bool, str]]]:
+    """splits {template} into components (separated by "/"), and each
+    component into pieces: (optional, format string) tuples.
+    Raises ValueError if brackets or braces are unbalanced."""
+    components = []
+    pieces = []
+    piece = []
+    optional = False
+    i = 0
+
+    def flush(new_optional):
+        nonlocal piece, optional
+        if piece:
+            pieces.append((optional, "".join(piece)))
+        piece = []
+        optional = new_optional
+
+    while i < len(template):
+        c = template[i]
+        pair = template[i:i+2]
+        if pair in ("{{", "}}"):
+            piece.append(pair)
+            i += 2
+        elif c == "{":
+            # copy the field including nested fields in its format spec
+            depth = 0
+            start = i
+            while i < len(template):
+                if template[i] == "{":
+                    depth += 1
+                elif template[i] == "}":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                i += 1
+            else:
+                raise ValueError(f"unbalanced braces in {template!r}")
+            piece.append(template[start:i+1])
+            i += 1
+        elif c == "}":
+            raise ValueError(f"single '}}' in {template!r}")
+        elif pair in ("[[", "]]"):
+            piece.append(c)
+            i += 2
+        elif c == "[":
+            if optional:
+                raise ValueError(f"nested '[' in {template!r}")
+            flush(True)
+            i += 1
+        elif c == "]":
+            if not optional:
+                raise ValueError(f"single ']' in {template!r}")
+            flush(False)
+            i += 1
+        elif c == "/":
+            if optional:
+                raise ValueError(f"'/' within '[...]' in {template!r}")
+            flush(False)
+            components.append(pieces)
+            pieces = []
+            i += 1
+        else:
+            piece.append(c)
+            i += 1
+
+    if optional:
+        raise ValueError(f"unbalanced '[' in {template!r}")
+    flush(False)
+    components.append(pieces)
+    return components
+
+
+def _fields(format: str) -> tuple[str]:
+    """returns the names of the fields used in {format}, including
+    fields in nested format specs."""
+    names = []
+    for _, name, spec, _ in string.Formatter().parse(format):
+        if name is not None:
+            # "title.upper" or "title[0]" use field "title"
+            names.append(name.partition(".")[0].partition("[")[0])
+        if spec:
+            names.extend(_fields(spec))
+    return tuple(names)
+
+
+class Template:
+    """A compiled naming template, see module documentation."""
+
+    def __init__(self, template: str, fields: dict):
+        """compiles {template}, using the field names and sample values
+        of {fields} (MOVIEFIELDS or SERIESFIELDS).
+        Raises ValueError if the template is invalid."""
+        self.template = template
+        self.components = []
+        for pieces in _split(template):
+            compiled = []
+            for optional, format in pieces:
+                names = _fields(format)
+                unknown = set(names) - fields.keys()
+                if "" in unknown:
+                    raise ValueError(
+                        f"positional field in {template!r}, use one of "
+                        f"{', '.join(fields)}")
+                if unknown:
+                    raise ValueError(
+                        f"unknown field {', '.join(sorted(unknown))} in "
+                        f"{template!r}, use one of {', '.join(fields)}")
+                if not names:
+                    # no fields: format in advance
+                    compiled.append((False, format.format(), names))
+                else:
+                    compiled.append((optional, format, names))
+            self.components.append(compiled)
+
+        if not self.components[-1]:
+            raise ValueError(f"no file name in {template!r}")
+
+        # folder names are memoized by the values of their fields
+        self.names = [
+            tuple(dict.fromkeys(
+                name for _, _, names in pieces for name in names
+            ))
+            for pieces in self.components
+        ]
+        self.folders = [
+            functools.lru_cache(maxsize=CACHESIZE)(
+                functools.partial(self._memoized, pieces, names)
+            )
+            for pieces, names in zip(self.components[:-1], self.names)
+        ]
+
+        # check format specs etc. with the sample values
+        self.path(fields)
+
+    @staticmethod
+    def _format(pieces: list, values: dict) -> str:
+        """formats and sanitizes one component."""
+        result = []
+        for optional, format, names in pieces:
+            if not names:
+                result.append(format)
+            elif optional and any(
+                values[name] is None or values[name] == "" for name in names
+            ):
+                continue
+            else:
+                result.append(format.format_map(values))
+        return utils.sanitize_filename("".join(result))
+
+    @classmethod
+    def _memoized(cls, pieces: list, names: tuple, *key) -> str:
+        return cls._format(pieces, dict(zip(names, key)))
+
+    def path(self, values: dict) -> str:
+        """returns the path of the new file relative to the base directory,
+        i.e. the folder names and the file name joined with os.sep,
+        formatted with {values}. Raises ValueError if the template cannot
+        be formatted with {values} or a component is empty."""
+        try:
+            components = [
+                folder(*(values[name] for name in names))
+                for folder, names in zip(self.folders, self.names)
+            ]
+            components.append(self._format(self.components[-1], values))
+        except (KeyError, TypeError, ValueError, AttributeError,
+                IndexError) as e:
+            raise ValueError(
+                f"cannot apply template {self.template!r} to {values}: {e!r}")
+        return os.path.join(*components)
+
+    def hasfolders(self) -> bool:
+        """returns True if the template contains folders."""
+        return bool(self.folders)
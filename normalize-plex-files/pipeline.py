@@ -0,0 +1,169 @@
+"""Pipeline Module for normalize-plex-files
+
+Processes the media items of the libraries in a pipeline of generators,
+each stage pulling media items from the previous one:
+- fetch():   executes a search query and fetches its rows in batches,
+             grouped by media item (see utils.groupparts()),
+- decode():  turns each media item into a compact record, a Movie or an
+             Episode,
+- name():    computes the moves of each media item with the base directory
+             and naming template of its library,
+- execute(): submits the moves of each media item as a job to an executor
+             (see executor.py).
+A stage only pulls the next media item when the following stage is ready
+for it, and an executor only accepts a bounded number of jobs not finished
+yet (see executor.BACKLOG). So the rows, media items and moves in flight
+are bounded: one batch of rows and a few media items at a time - unless
+all jobs of a run are collected, see preflight.py, dirmanager.DirBatch,
+dirrename.py and scheduler.DeviceScheduler.
+
+Memory still grows with the library, though much less than with the
+moves themselves: SQLite sorts all rows for ORDER BY before the first one
+is fetched, and a run remembers per directory its listing (dirindex.py),
+its device (crossmove.py), whether it exists (dirmanager.py) and the
+moves out of it to clean up (dirmanager.Cleanup).
+"""
+
+import functools
+import os
+import sqlite3
+import sys
+import time
+from types import SimpleNamespace
+from typing import Callable, Iterable, Iterator, NamedTuple, Union
+import shard
+import stats
+import utils
+from plan import Move
+
+
+class Movie(NamedTuple):
+    """A movie, i.e. one media item of a movies library: the columns of a
+    row of the movies search query, and the files of all its parts."""
+    title: str
+    year: int
+    edition: str
+    db_ref: str
+    width: int
+    height: int
+    section: str
+    metadata_item_id: int
+    media_item_id: int
+    changed_at: int
+    parts: tuple[str, ...]
+
+
+class Episode(NamedTuple):
+    """An episode, i.e. one media item of a series library: the columns of
+    a row of the series search query, and the files of all its parts."""
+    series: str
+    year: int
+    db_ref: str
+    season: int
+    episode: int
+    title: str
+    width: int
+    height: int
+    section: str
+    metadata_item_id: int
+    media_item_id: int
+    changed_at: int
+    parts: tuple[str, ...]
+
+
+Item = Union[Movie, Episode]
+
+
+def fetch(con: sqlite3.Connection, query: str, params: dict,
+          config: SimpleNamespace) -> Iterator[tuple[tuple, list[str]]]:
+    """executes {query} with {params} and yields the rows grouped by media
+    item, see utils.groupparts()."""
+    if config.debug:
+        print("Searching database.", file=sys.stderr)
+
+    with stats.timed("query"):
+        res = con.execute(query, params)
+
+    if config.debug:
+        print("Parsing result.", file=sys.stderr)
+
+    yield from stats.timediter("fetch", utils.groupparts(res))
+
+
+def decode(groups: Iterable[tuple[tuple, list[str]]],
+           record: type) -> Iterator[Item]:
+    """yields a {record} (Movie or Episode) for each media item of
+    {groups}."""
+    for fields, parts in groups:
+        yield record(*fields, tuple(parts))
+
+
+def name(items: Iterable[Item], libraries: dict,
+         config: SimpleNamespace) -> Iterator[tuple[Item, list[Move]]]:
+    """yields each media item of {items} with its moves. {libraries} are
+    the (library, naming template) tuples by library name. Media items
+    left to other shards (see shard.py) are left out, as are parts that
+    cannot be named."""
+    for item in items:
+        start = time.perf_counter()
+        library, template = libraries[item.section]
+
+        if not shard.selected(config, library.base, item.metadata_item_id,
+                              item.parts[0]):
+            stats.count("filtered")
+            continue
+
+        if isinstance(item, Episode) and not item.title:
+            item = item._replace(title=f"Folge {item.episode}")
+
+        if config.debug:
+            print(item.title, list(item.parts), file=sys.stderr)
+
+        values = item._asdict()
+        values["resolution"] = utils.resolutionstring(item.height, item.width)
+        moves = []
+
+        for idx, part in enumerate(item.parts):
+
+            # multipart
+            values["part"] = f" - part{idx+1}" if len(item.parts) > 1 else ""
+            try:
+                base_dir = utils.basedir(library.base, part, library.subdirs)
+                new_file = os.path.join(base_dir, template.path(values))
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                stats.count("skips")
+                continue    # skip this file and continue with next
+
+            if config.debug:
+                print(f"base_dir: {base_dir}", file=sys.stderr)
+
+            mkdir = None
+            if template.hasfolders():
+                mkdir = os.path.dirname(new_file)
+
+            # old filename without extension
+            old_file = os.path.splitext(part)[0]
+
+            if old_file != new_file:
+                moves.append(Move(
+                    old_file, new_file, mkdir, os.path.dirname(old_file)
+                ))
+            else:
+                stats.count("unchanged")
+
+        stats.count("items")
+        stats.count("parts", len(item.parts))
+        stats.count("moves", len(moves))
+        stats.add("naming", time.perf_counter() - start)
+
+        yield item, moves
+
+
+def execute(jobs: Iterable[tuple[Item, list[Move]]], executor,
+            done: Callable[[Item, list[Move], bool], None] = None) -> None:
+    """submits the moves of each media item of {jobs} to {executor}. When a
+    job has been reported, {done}(item, moves, success) is called."""
+    for item, moves in jobs:
+        executor.submit(moves,
+                        functools.partial(done, item, moves) if done else None)
@@ -0,0 +1,94 @@
+"""Plan Module for normalize-plex-files
+
+Separates computing the moves (which needs the Plex database) from
+executing them (which only needs the file system):
+- with --plan, the computed moves are written to a plan file by a
+  PlanWriter instead of being executed,
+- with --apply, the moves are read back from a plan file by readplan()
+  and executed without opening the Plex database.
+
+The plan file is in JSON Lines format, one move per line, e.g.
+{"old":"/data/plex/Filme/a/casino","new":"/data/plex/Filme/a/Casino Royale (1967) {tmdb-12208} [720x336]","rmdir":"/data/plex/Filme/a"}
+Attributes that are null are omitted. A plan file name of "-" means
+stdout or stdin, respectively.
+"""
+
+import json
+import sys
+from typing import Callable, Iterator, NamedTuple
+
+
+class Move(NamedTuple):
+    """Move of all files with basename {old_file} to basename {new_file}.
+    {mkdir} is the directory to create before, {rmdir} the directory to
+    remove after the move, if not None."""
+    old_file: str
+    new_file: str
+    mkdir: str = None
+    rmdir: str = None
+
+
+# plan file attribute names of the Move fields
+KEYS = {
+    "old_file": "old",
+    "new_file": "new",
+    "mkdir":    "mkdir",
+    "rmdir":    "rmdir",
+}
+
+
+class PlanWriter:
+    """Writes moves to a plan file. Can be used in place of an
+    executor.MoveExecutor."""
+
+    def __init__(self, file: str):
+        if file == "-":
+            self.f = sys.stdout
+        else:
+            self.f = open(file, "w", encoding="utf-8")
+
+    def submit(self, moves: list[Move],
+               callback: Callable[[bool], None] = None) -> None:
+        """writes {moves} to the plan file. {callback} is never called, as
+        nothing has been moved."""
+        for move in moves:
+            record = {
+                KEYS[key]: value
+                for key, value in move._asdict().items() if value is not None
+            }
+            self.f.write(json.dumps(record, ensure_ascii=False,
+                                    separators=(",", ":")) + "\n")
+
+    def close(self) -> None:
+        """flushes and closes the plan file."""
+        if self.f is sys.stdout:
+            self.f.flush()
+        else:
+            self.f.close()
+
+
+def readplan(file: str) -> Iterator[Move]:
+    """yields the moves of plan file {file}.
+    Raises ValueError on malformed lines."""
+    f = sys.stdin if file == "-" else open(file, "r", encoding="utf-8")
+    try:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.decoder.JSONDecodeError as err:
+                raise ValueError(f"{file}, line {lineno}: {err}")
+            if not isinstance(record, dict) \
+                    or not isinstance(record.get("old"), str) \
+                    or not isinstance(record.get("new"), str):
+                raise ValueError(
+                    f"{file}, line {lineno}: old and new are mandatory")
+            for name in ("mkdir", "rmdir"):
+                if not isinstance(record.get(name), (str, type(None))):
+                    raise ValueError(
+                        f"{file}, line {lineno}: {name} must be a string")
+            yield Move(**{key: record.get(name) for key, name in KEYS.items()})
+    finally:
+        if f is not sys.stdin:
+            f.close()
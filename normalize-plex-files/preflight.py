@@ -0,0 +1,152 @@
+"""Preflight Module for normalize-plex-files
+
+Finds target collisions of a whole run before any file is touched. Without
+this, a collision is only noticed when linking a file fails with "File
+exists" in the middle of an armed run, leaving a media item half moved.
+
+A Preflight collects all jobs of a run and puts every target path - the
+new name of every file of a move, including sidecar files like .srt - into
+a hash index. A target collides if it is
+- the target of an earlier move as well, e.g. two media versions of a
+  movie with the same resolution, or two movies with the same title and
+  year, or
+- an existing file, unless that file is moved away before, by an earlier
+  job or by an earlier move of the same job, or is the file itself
+  already (a move interrupted before the old name was unlinked, see
+  utils.movefile()).
+Depending on {config.collisions} (see COLLISIONS), media items with
+collisions are then
+- "skip":   reported and skipped, all other media items are moved,
+- "rename": moved to a disambiguated name, e.g. "Casino Royale (1967) (2)",
+- "abort":  reported, and nothing is moved at all.
+"off" disables the preflight.
+"""
+
+import sys
+from types import SimpleNamespace
+from typing import Callable
+import crossmove
+import dirindex
+import stats
+from plan import Move
+
+
+COLLISIONS = ("off", "skip", "rename", "abort")
+
+
+class Preflight:
+    """Collects all jobs submitted, resolves their target collisions (see
+    module documentation) and only then hands the jobs on to {executor}.
+    Can be used in place of an executor.MoveExecutor."""
+
+    def __init__(self, executor, config: SimpleNamespace):
+        self.executor = executor
+        self.config = config
+        self.jobs = []
+        # number of collisions found by close()
+        self.collisions = 0
+
+    def submit(self, moves: list[Move],
+               callback: Callable[[bool], None] = None) -> None:
+        """collects a job, see executor.MoveExecutor.submit()."""
+        self.jobs.append((moves, callback))
+
+    def _report(self, target: str, move: Move, reason: str) -> None:
+        self.collisions += 1
+        stats.count("collisions")
+        print(f"collision: {target} (from {move.old_file}) {reason}",
+              file=sys.stderr)
+
+    def close(self) -> None:
+        """checks all jobs for collisions, then submits the jobs to the
+        executor and closes it. With "abort", nothing is submitted if
+        there are collisions."""
+        # source file -> (index of the job, index of the move) moving it
+        # away, as the moves of a job are executed in order
+        sources = {}
+        for i, (moves, _) in enumerate(self.jobs):
+            for j, move in enumerate(moves):
+                for file in dirindex.sidecars(move.old_file):
+                    sources.setdefault(file, (i, j))
+
+        # target file -> source file
+        targets = {}
+        resolved = []
+
+        for i, (moves, callback) in enumerate(self.jobs):
+            collided = False
+            checked = []
+            for j, move in enumerate(moves):
+                files = dirindex.sidecars(move.old_file)
+                suffix = 1
+                while True:
+                    new_file = move.new_file
+                    if suffix > 1:
+                        new_file += f" ({suffix})"
+                    collision = self._check((i, j), move, new_file, files,
+                                            sources, targets,
+                                            report=suffix == 1)
+                    if not collision or self.config.collisions != "rename":
+                        break
+                    suffix += 1
+                if collision:
+                    collided = True
+                if new_file != move.new_file:
+                    print(f"renaming {move.new_file} to {new_file}",
+                          file=sys.stderr)
+                    move = move._replace(new_file=new_file)
+                for file in files:
+                    targets.setdefault(
+                        move.new_file + file[len(move.old_file):], file)
+                checked.append((move, files))
+
+            if collided:
+                # skip the whole media item, so it is not half moved
+                for move, files in checked:
+                    for file in files:
+                        target = move.new_file + file[len(move.old_file):]
+                        if targets.get(target) == file:
+                            del targets[target]
+                        if sources.get(file, (None,))[0] == i:
+                            del sources[file]
+                if callback:
+                    callback(False)
+                continue
+
+            resolved.append(([move for move, _ in checked], callback))
+
+        self.jobs.clear()
+
+        if self.config.collisions == "abort" and self.collisions:
+            print(f"{self.collisions} collisions, nothing moved.",
+                  file=sys.stderr)
+            self.executor.close()
+            return
+
+        for moves, callback in resolved:
+            self.executor.submit(moves, callback)
+        self.executor.close()
+
+    def _check(self, position: tuple[int, int], move: Move, new_file: str,
+               files: list[str], sources: dict, targets: dict,
+               report: bool) -> bool:
+        """returns True if moving {files} of {move} (at {position}, the
+        indexes of its job and of the move in the job) to {new_file}
+        collides, reporting the collisions if {report}. An existing target
+        does not collide if it is moved away before, by an earlier job or
+        by an earlier move of the same job."""
+        collision = False
+        for file in files:
+            target = new_file + file[len(move.old_file):]
+            if target in targets:
+                if report:
+                    self._report(target, move,
+                                 f"is also the target of {targets[target]}")
+                collision = True
+            elif dirindex.exists(target) \
+                    and sources.get(target, position) >= position \
+                    and not crossmove.same(file, target):
+                if report:
+                    self._report(target, move, "exists already")
+                collision = True
+        return collision
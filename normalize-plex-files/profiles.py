@@ -0,0 +1,127 @@
+"""Profiles Module for normalize-plex-files
+
+Normalizes the libraries of several Plex servers in one run. Each server
+is described by a profile in the config file, e.g.
+    {
+      "profiles": {
+        "family":  {"database": "/srv/family/.../com.plexapp.plugins.library.db",
+                    "moviesbase": "/data/family/Filme/"},
+        "4k":      {"database": "/srv/4k/.../com.plexapp.plugins.library.db",
+                    "moviesbase": "/data/4k/Filme/", "jobs": 4}
+      }
+    }
+The settings of a profile override the other settings of the config file;
+environment variables and command line options apply to all profiles.
+{config.profilenames} are the profiles to normalize.
+
+The profiles are normalized in parallel, in a pool of {config.processes}
+processes (0: one per profile). As the state of a run (directory index,
+throttling, statistics, journal, ...) is kept in module variables, each
+profile gets its own process, with its own database connection. The state
+file, the journal and the changed-directories file (see rescan.py) of a
+profile get the suffix ".<profile>", unless the profile sets them itself.
+
+Output lines are prefixed with "[<profile>] ". The statistics of all
+profiles are merged into one report (see stats.merge()), so a single
+scheduled job normalizes all servers in the time of the slowest one.
+"""
+
+import concurrent.futures
+import io
+import sys
+from types import SimpleNamespace
+from typing import Callable, TextIO
+import scheduler
+import stats
+from config import getconfig
+
+
+class _Prefixed(io.TextIOBase):
+    """Writes each complete line written to it to {f}, prefixed with
+    {prefix}."""
+
+    def __init__(self, f: TextIO, prefix: str):
+        self.f = f
+        self.prefix = prefix
+        # incomplete last line
+        self.line = ""
+
+    def write(self, s: str) -> int:
+        lines = (self.line + s).split("\n")
+        self.line = lines.pop()
+        if lines:
+            self.f.write("".join(f"{self.prefix}{line}\n" for line in lines))
+            self.f.flush()
+        return len(s)
+
+    def flush(self) -> None:
+        self.f.flush()
+
+    def close(self) -> None:
+        if self.line:
+            self.write("\n")
+
+
+def _normalize(name: str, config: SimpleNamespace,
+               normalize: Callable[[SimpleNamespace], None]) -> tuple[int, dict]:
+    """runs {normalize}({config}) for profile {name} in a pool process.
+    Returns the exit code and the metrics of the run."""
+    stats.reset()
+    scheduler.setup(config)
+    out = sys.stdout = _Prefixed(sys.stdout, f"[{name}] ")
+    err = sys.stderr = _Prefixed(sys.stderr, f"[{name}] ")
+
+    code = 0
+    try:
+        normalize(config)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        print(e, file=sys.stderr)
+        stats.count("errors")
+        code = 1
+    finally:
+        out.close()
+        err.close()
+        sys.stdout, sys.stderr = out.f, err.f
+    return code, stats.snapshot()
+
+
+def run(config: SimpleNamespace,
+        normalize: Callable[[SimpleNamespace], None]) -> bool:
+    """normalizes the profiles {config.profilenames} in parallel with
+    {normalize}, and merges their metrics. Returns False if any profile
+    failed."""
+    configs = {name: getconfig(name) for name in config.profilenames}
+
+    # output buffered now would be written by every process
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(
+        config.processes or len(configs)
+    ) as pool:
+        futures = {
+            pool.submit(_normalize, name, profile, normalize): name
+            for name, profile in configs.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                code, metrics = future.result()
+            except Exception as e:
+                # e.g. a process killed
+                print(f"[{name}] {e}", file=sys.stderr)
+                stats.count("errors")
+                failed.append(name)
+                continue
+            stats.merge(metrics, name)
+            if code:
+                failed.append(name)
+
+    if failed:
+        print(f"profiles failed: {', '.join(sorted(failed))}",
+              file=sys.stderr)
+        return False
+    return True
@@ -0,0 +1,148 @@
+"""Rescan Module for normalize-plex-files
+
+After files have been moved, Plex has to scan its libraries to find them
+under their new names. Instead of scanning whole libraries, Plex can scan
+single directories (partial scans). A Changes object collects the source
+and target directories of the moves of a run, per library section. They
+are
+- written to {config.changedfile} in JSON Lines format, one directory per
+  line, e.g. {"section":"Filme","path":"/data/plex/Filme/a"}, and/or
+- sent to the partial scan endpoint of the Plex server at
+  {config.plexurl}, one request per directory:
+      GET <plexurl>/library/sections/<section id>/refresh?path=<directory>
+  authenticated with {config.plextoken}.
+
+Directories removed by the run are replaced by their nearest existing
+parent, and directories below another changed directory are left out, as
+a scan includes subdirectories. If more than {config.scanbatch}
+directories of a section changed, they are batched: the deepest ones are
+replaced by their parents, until at most {config.scanbatch} directories
+remain (at most the library base directory).
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+from types import SimpleNamespace
+import stats
+
+
+# seconds to wait for the Plex server to answer a request
+TIMEOUT = 30
+
+
+class Changes:
+    """Collects the directories changed by the moves of a run, by library
+    section."""
+
+    def __init__(self):
+        # section -> directories
+        self.dirs: dict[str, set[str]] = {}
+
+    def record(self, section: str, moves: list) -> None:
+        """records the source and target directories of {moves} of a media
+        item of library {section}."""
+        if not moves:
+            return
+        dirs = self.dirs.setdefault(section, set())
+        for move in moves:
+            dirs.add(os.path.dirname(move.old_file))
+            dirs.add(os.path.dirname(move.new_file))
+
+    def paths(self, section: str, base: str, limit: int = 0) -> list[str]:
+        """returns the directories to scan for library {section} with base
+        directory {base}: existing, without subdirectories of each other,
+        and if {limit}, batched into at most {limit} directories."""
+        base = os.path.normpath(base)
+
+        def existing(dir):
+            while not os.path.isdir(dir) and len(dir) > len(base):
+                dir = os.path.dirname(dir)
+            return dir
+
+        paths = {existing(dir) for dir in self.dirs.get(section, ())}
+
+        while limit and len(_outermost(paths)) > limit:
+            depth = max(dir.count(os.sep) for dir in paths)
+            paths = {
+                os.path.dirname(dir)
+                if dir.count(os.sep) == depth and len(dir) > len(base)
+                else dir
+                for dir in paths
+            }
+            if all(len(dir) <= len(base) for dir in paths):
+                break
+
+        return _outermost(paths)
+
+
+def _outermost(paths: set[str]) -> list[str]:
+    """returns the sorted {paths} that are not below another one."""
+    result = []
+    for dir in sorted(paths):
+        if not result or not dir.startswith(os.path.join(result[-1], "")):
+            result.append(dir)
+    return result
+
+
+def write(file: str, changes: Changes, libraries: dict,
+          limit: int = 0) -> None:
+    """writes the directories to scan (see Changes.paths()) of {libraries}
+    (library by name) to {file} (- for stdout).
+    Raises OSError if the file cannot be written."""
+    f = sys.stdout if file == "-" else open(file, "w", encoding="utf-8")
+    try:
+        for name, library in libraries.items():
+            for path in changes.paths(name, library.base, limit):
+                f.write(json.dumps({"section": name, "path": path},
+                                   ensure_ascii=False, separators=(",", ":"))
+                        + "\n")
+    finally:
+        if f is sys.stdout:
+            f.flush()
+        else:
+            f.close()
+
+
+def scan(config: SimpleNamespace, con: sqlite3.Connection,
+         changes: Changes, libraries: dict) -> bool:
+    """requests a partial scan of the directories to scan (see
+    Changes.paths()) of {libraries} (library by name) from the Plex server
+    at {config.plexurl}. The section ids are looked up in database {con}.
+    Returns False if any request failed."""
+    success = True
+    for name, library in libraries.items():
+        paths = changes.paths(name, library.base, config.scanbatch)
+        if not paths:
+            continue
+        row = con.execute("SELECT id FROM library_sections WHERE name = ?",
+                          (name,)).fetchone()
+        if row is None:
+            print(f"library {name!r} not found, cannot scan it",
+                  file=sys.stderr)
+            success = False
+            continue
+
+        for path in paths:
+            url = (f"{config.plexurl.rstrip('/')}/library/sections/{row[0]}"
+                   f"/refresh?{urllib.parse.urlencode({'path': path})}")
+            request = urllib.request.Request(url)
+            if config.plextoken:
+                request.add_header("X-Plex-Token", config.plextoken)
+            if config.debug:
+                print(f"scanning {path}", file=sys.stderr)
+            try:
+                with stats.timed("rescan"):
+                    with urllib.request.urlopen(request, timeout=TIMEOUT):
+                        pass
+            except (urllib.error.URLError, OSError) as e:
+                print(f"cannot scan {path}: {e}", file=sys.stderr)
+                stats.count("errors")
+                success = False
+            else:
+                stats.count("rescans")
+    return success
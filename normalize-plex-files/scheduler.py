@@ -0,0 +1,184 @@
+"""I/O Scheduler Module for normalize-plex-files
+
+Keeps armed runs from saturating the disks while Plex is streaming from
+them:
+- {config.iops} and {config.bandwidth} limit the file system calls and
+  the bytes copied across filesystems (see crossmove.py) per second, per
+  device (st_dev). All modules calling the file system call op() before
+  each call, and crossmove.copyfile() calls transferred() after each chunk
+  copied; both wait as long as needed to keep the device below its limits.
+  The time waited is recorded as phase "throttle" (see stats.py).
+- with {config.deviceorder}, a DeviceScheduler collects all jobs of a run,
+  groups them by the device of their source directory and submits each
+  device's jobs in directory order, taking turns between the devices. So
+  each device works through its directories one after another, instead of
+  seeking back and forth (and spinning up) in the order of the titles.
+- with {config.lowpriority}, setup() lowers the CPU and I/O priority of
+  the process, so Plex is served first.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable
+import crossmove
+import stats
+
+
+# smallest chunk copied at once when {config.bandwidth} is limited
+MINCHUNK = 1024 * 1024
+
+# suffixes of --bandwidth values
+UNITS = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+
+def parsesize(value) -> int:
+    """returns the number of bytes of {value}, e.g. 1048576, "1048576",
+    "512k", "50M" or "1.5G". Raises ValueError if {value} is invalid."""
+    value = str(value).strip().lower()
+    factor = UNITS.get(value[-1:], 1)
+    if factor > 1:
+        value = value[:-1]
+    try:
+        result = int(float(value) * factor)
+    except OverflowError:
+        raise ValueError(f"invalid size {value!r}")
+    if result < 0:
+        raise ValueError(f"negative size {value!r}")
+    return result
+
+
+class _Bucket:
+    """Rate limiter: take() waits until {rate} units per second have been
+    taken on average."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.lock = threading.Lock()
+        # time the next unit may be taken
+        self.next = time.monotonic()
+
+    def take(self, n: float) -> None:
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.next, now)
+            self.next = start + n / self.rate
+        if start > now:
+            with stats.timed("throttle"):
+                time.sleep(start - now)
+
+
+_iops = 0.0
+_bandwidth = 0
+# (st_dev, limit) -> bucket
+_buckets: dict[tuple, _Bucket] = {}
+_lock = threading.Lock()
+
+
+def setup(config: SimpleNamespace) -> None:
+    """sets the limits of {config.iops} and {config.bandwidth} (0 is
+    unlimited), and lowers the priority of the process if
+    {config.lowpriority}."""
+    global _iops, _bandwidth
+    with _lock:
+        _iops = config.iops
+        _bandwidth = config.bandwidth
+        _buckets.clear()
+
+    if config.lowpriority:
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, 19)
+        except (AttributeError, OSError) as e:
+            print(f"cannot lower CPU priority: {e}", file=sys.stderr)
+        # idle I/O scheduling class (Linux), best effort
+        ionice = shutil.which("ionice")
+        if ionice:
+            subprocess.run([ionice, "-c", "3", "-p", str(os.getpid())],
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=False)
+
+
+def _device(dir: str):
+    """returns the st_dev of {dir}, or of its nearest existing parent
+    (e.g. for a directory not created yet)."""
+    while True:
+        try:
+            return crossmove.device(dir)
+        except OSError:
+            parent = os.path.dirname(dir)
+            if parent == dir:
+                return None
+            dir = parent
+
+
+def _bucket(dev, limit: str, rate: float) -> _Bucket:
+    with _lock:
+        try:
+            return _buckets[dev, limit]
+        except KeyError:
+            bucket = _buckets[dev, limit] = _Bucket(rate)
+            return bucket
+
+
+def op(dir: str) -> None:
+    """waits until another file system call in directory {dir} is within
+    the {config.iops} limit of its device."""
+    if _iops:
+        _bucket(_device(dir), "iops", _iops).take(1)
+
+
+def transferred(n: int, dirs: tuple[str, ...]) -> None:
+    """waits until the {n} bytes just copied from or to directories {dirs}
+    are within the {config.bandwidth} limit of their devices."""
+    if _bandwidth:
+        for dev in {_device(dir) for dir in dirs}:
+            _bucket(dev, "bandwidth", _bandwidth).take(n)
+
+
+def chunksize(default: int) -> int:
+    """returns the number of bytes to copy at once: {default}, or less if
+    {config.bandwidth} is limited, so copies are throttled smoothly."""
+    if _bandwidth:
+        return max(MINCHUNK, min(default, _bandwidth // 4))
+    return default
+
+
+class DeviceScheduler:
+    """Collects all jobs submitted and hands them on to {executor} grouped
+    by device and in directory order (see module documentation). Can be
+    used in place of an executor.MoveExecutor."""
+
+    def __init__(self, executor, config: SimpleNamespace):
+        self.executor = executor
+        self.config = config
+        self.jobs = []
+
+    def submit(self, moves: list, callback: Callable[[bool], None] = None) -> None:
+        """collects a job, see executor.MoveExecutor.submit()."""
+        self.jobs.append((moves, callback))
+
+    def close(self) -> None:
+        """submits all jobs to the executor, taking turns between the
+        devices, and closes it."""
+        # device -> jobs, in order of their source directories
+        queues = {}
+        for i, (moves, callback) in enumerate(self.jobs):
+            dir = os.path.dirname(moves[0].old_file) if moves else ""
+            dev = _device(dir) if dir else None
+            queues.setdefault(dev, []).append((dir, i, moves, callback))
+        self.jobs.clear()
+
+        queues = [iter(sorted(queue)) for queue in queues.values()]
+        while queues:
+            for queue in list(queues):
+                job = next(queue, None)
+                if job is None:
+                    queues.remove(queue)
+                    continue
+                _, _, moves, callback = job
+                self.executor.submit(moves, callback)
+        self.executor.close()
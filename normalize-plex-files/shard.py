@@ -0,0 +1,65 @@
+"""Shard Module for normalize-plex-files
+
+Selects the media items a process normalizes, so several processes or
+hosts can each normalize a disjoint slice of the libraries in parallel,
+e.g. each host the part of the library on the storage it mounts locally:
+- {config.shard} (K, N) selects shard K of N (1 <= K <= N). Media items
+  are assigned to shards by a hash of SHARDKEYS[{config.shardby}]:
+  "item", the metadata item id, or "subdir", the first directory of the
+  media file below the library base directory, so all media items in
+  such a directory are normalized by the same shard,
+- {config.pathprefix} (a list) only selects media items with a media file
+  in or below one of the directories given.
+A media item is selected as a whole, by the file of its first part, so it
+is never moved by two processes, and never moved only partly.
+
+The hash (CRC-32) does not depend on the process or host, unlike Python's
+hash(), so all processes agree on the assignment.
+"""
+
+import os
+import zlib
+from types import SimpleNamespace
+
+
+SHARDKEYS = ("item", "subdir")
+
+
+def parse(spec: str) -> tuple[int, int]:
+    """returns (K, N) of shard specification {spec} "K/N".
+    Raises ValueError if {spec} is invalid."""
+    try:
+        k, n = (int(number) for number in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"shard {spec!r} is not of the form K/N")
+    if not 1 <= k <= n:
+        raise ValueError(f"shard {spec!r}: K must be between 1 and N")
+    return k, n
+
+
+def key(config: SimpleNamespace, base: str, item_id: int, file: str) -> str:
+    """returns the key media item {item_id} with first media file {file}
+    in library base directory {base} is assigned to a shard by."""
+    if config.shardby == "subdir":
+        relpath = os.path.relpath(file, base)
+        first = relpath.split(os.sep, 1)[0]
+        # files directly in the base directory share a shard
+        return "" if first in (relpath, os.pardir) else first
+    return str(item_id)
+
+
+def selected(config: SimpleNamespace, base: str, item_id: int,
+             file: str) -> bool:
+    """returns True if media item {item_id} with first media file {file} in
+    library base directory {base} is to be normalized by this process."""
+    if config.pathprefix and not any(
+        file.startswith(os.path.join(prefix, ""))
+        for prefix in config.pathprefix
+    ):
+        return False
+    if config.shard:
+        k, n = config.shard
+        hash = zlib.crc32(os.fsencode(key(config, base, item_id, file)))
+        if hash % n != k - 1:
+            return False
+    return True
@@ -16,15 +16,30 @@
 --
 -- VSCode SQLite can happily run this file as SQLite code (swith vs code language to SQL or SQLite).
 -- https://marketplace.visualstudio.com/items?itemName=alexcvzz.vscode-sqlite
--- However, to find any results you need to set the named parameter »:movies_section_name«
--- in settings.json as in the example below, using whatever name your movies library actually uses:
+-- However, to find any results you need to set the named parameter »:movies_sections«, a JSON
+-- array of library names, in settings.json as in the example below, using whatever names your
+-- movies libraries actually use:
 --     "sqlite.setupDatabase": {      
---       "./plex.db": {"sql": [".parameter init",".parameter set :movies_section_name \"'Filme'\"",".parameter set :series_section_name \"'Serien'\""]}
+--       "./plex.db": {"sql": [".parameter init",".parameter set :movies_sections \"'[\\\"Filme\\\"]'\"",".parameter set :series_sections \"'[\\\"Serien\\\"]'\"",".parameter set :since NULL"]}
 --     }
 --
 -- Prettier-SQL will also be happy with this file (swith vs code language to SQLite).
 -- https://marketplace.visualstudio.com/items?itemName=inferrinizzard.prettier-sql-vscode
 --
+WITH
+    /* filter the library sections before any aggregation, so the media
+       and tags subqueries only aggregate rows of these sections */
+    section_items AS (
+        SELECT
+            metadata_items.id,
+            library_sections.name AS section
+        FROM
+            metadata_items
+            JOIN library_sections ON library_sections.id = metadata_items.library_section_id
+        WHERE
+            library_sections.name IN (SELECT value FROM json_each(:movies_sections))
+            AND metadata_items.metadata_type = 1
+    )
 SELECT
     metadata_items.title,
     metadata_items.year,
@@ -39,52 +54,68 @@ SELECT
     ) AS db_ref,
     media.width,
     media.height,
-    media.files
+    /* library the media item belongs to, for the base directory and naming */
+    section_items.section,
+    metadata_items.id AS metadata_item_id,
+    media.id AS media_item_id,
+    MAX(
+        IFNULL(metadata_items.updated_at, 0),
+        IFNULL(media.updated_at, 0)
+    ) AS changed_at,
+    /* one row per part, no serialization of filenames needed */
+    media_parts.file
 FROM
-    metadata_items
-    LEFT JOIN library_sections ON library_sections.id = metadata_items.library_section_id
-    LEFT JOIN (
+    section_items
+    JOIN metadata_items ON metadata_items.id = section_items.id
+    JOIN (
         SELECT
             media_items.metadata_item_id,
             media_items.width,
             media_items.height,
             media_items.id,
-            /* use || as filename separator, to prevent || in filenames escape each | as \| */
-            GROUP_CONCAT(REPLACE(media_parts.file, '|', '\|'), '||') AS files
+            /* latest change of the media item or any of its parts, for --incremental */
+            MAX(
+                IFNULL(media_items.updated_at, 0),
+                IFNULL(MAX(media_parts.updated_at), 0)
+            ) AS updated_at
         FROM
             media_items
             LEFT JOIN media_parts ON media_parts.media_item_id = media_items.id
+        WHERE
+            media_items.metadata_item_id IN (SELECT id FROM section_items)
         GROUP BY
             media_items.id
     ) AS media ON media.metadata_item_id = metadata_items.id
+    JOIN media_parts ON media_parts.media_item_id = media.id
     LEFT JOIN (
         SELECT
             taggings.metadata_item_id,
-            MIN(imdb.tag) AS imdb,
-            MIN(tmdb.tag) AS tmdb,
-            MIN(tvdb.tag) AS tvdb
+            /* join tags once and pick the ids by prefix */
+            MIN(CASE WHEN tags.tag LIKE 'imdb://%' THEN tags.tag END) AS imdb,
+            MIN(CASE WHEN tags.tag LIKE 'tmdb://%' THEN tags.tag END) AS tmdb,
+            MIN(CASE WHEN tags.tag LIKE 'tvdb://%' THEN tags.tag END) AS tvdb
         FROM
             taggings
-            LEFT JOIN tags AS imdb ON taggings.tag_id = imdb.id
-            AND imdb.tag_type = 314
-            AND imdb.tag LIKE 'imdb://%'
-            LEFT JOIN tags AS tmdb ON taggings.tag_id = tmdb.id
-            AND tmdb.tag_type = 314
-            AND tmdb.tag LIKE 'tmdb://%'
-            LEFT JOIN tags AS tvdb ON taggings.tag_id = tvdb.id
-            AND tvdb.tag_type = 314
-            AND tvdb.tag LIKE 'tvdb://%'
+            JOIN tags ON taggings.tag_id = tags.id
+            AND tags.tag_type = 314
+        WHERE
+            taggings.metadata_item_id IN (SELECT id FROM section_items)
         GROUP BY
             taggings.metadata_item_id
     ) AS tags ON tags.metadata_item_id = metadata_items.id
 WHERE
     metadata_items.title IS NOT NULL
     AND metadata_items.title != ''
-    AND library_sections.name = :movies_section_name
-    AND metadata_items.metadata_type = 1
-GROUP BY
-    media.id
+    /* --incremental: only fetch items changed since the last run */
+    AND (
+        :since IS NULL
+        OR changed_at >= :since
+    )
 ORDER BY
-    metadata_items.title ASC;
+    metadata_items.title ASC,
+    /* parts of a media item must be adjacent and in order */
+    media.id ASC,
+    media_parts."index" ASC,
+    media_parts.file ASC;
 
 -- """
\ No newline at end of file
@@ -16,15 +16,40 @@
 --
 -- VSCode SQLite can happily run this file as SQLite code (swith vs code language to SQL or SQLite).
 -- https://marketplace.visualstudio.com/items?itemName=alexcvzz.vscode-sqlite
--- However, to find any results you need to set the named parameter »:series_section_name«
--- in settings.json as in the example below, using whatever name your tv shows library actually uses:
+-- However, to find any results you need to set the named parameter »:series_sections«, a JSON
+-- array of library names, in settings.json as in the example below, using whatever names your
+-- tv shows libraries actually use:
 --     "sqlite.setupDatabase": {      
---       "./plex.db": {"sql": [".parameter init",".parameter set :movies_section_name \"'Filme'\"",".parameter set :series_section_name \"'Serien'\""]}
+--       "./plex.db": {"sql": [".parameter init",".parameter set :movies_sections \"'[\\\"Filme\\\"]'\"",".parameter set :series_sections \"'[\\\"Serien\\\"]'\"",".parameter set :since NULL"]}
 --     }
 --
 -- Prettier-SQL will also be happy with this file (swith vs code language to SQLite).
 -- https://marketplace.visualstudio.com/items?itemName=inferrinizzard.prettier-sql-vscode
 --
+WITH
+    /* filter the library sections before any aggregation, so the media
+       and tags subqueries only aggregate rows of these sections */
+    section_episodes AS (
+        SELECT
+            metadata_items.id,
+            library_sections.name AS section
+        FROM
+            metadata_items
+            JOIN library_sections ON library_sections.id = metadata_items.library_section_id
+        WHERE
+            library_sections.name IN (SELECT value FROM json_each(:series_sections))
+            AND metadata_items.metadata_type = 4
+    ),
+    section_shows AS (
+        SELECT
+            metadata_items.id
+        FROM
+            metadata_items
+            JOIN library_sections ON library_sections.id = metadata_items.library_section_id
+        WHERE
+            library_sections.name IN (SELECT value FROM json_each(:series_sections))
+            AND metadata_items.metadata_type = 2
+    )
 SELECT
     grandparent.title AS series,
     grandparent.year,
@@ -41,56 +66,74 @@ SELECT
     metadata_items.title,
     media.width,
     media.height,
-    media.files
+    /* library the media item belongs to, for the base directory and naming */
+    section_episodes.section,
+    metadata_items.id AS metadata_item_id,
+    media.id AS media_item_id,
+    MAX(
+        IFNULL(metadata_items.updated_at, 0),
+        IFNULL(parent.updated_at, 0),
+        IFNULL(grandparent.updated_at, 0),
+        IFNULL(media.updated_at, 0)
+    ) AS changed_at,
+    /* one row per part, no serialization of filenames needed */
+    media_parts.file
 FROM
-    metadata_items
-    LEFT JOIN library_sections ON library_sections.id = metadata_items.library_section_id
+    section_episodes
+    JOIN metadata_items ON metadata_items.id = section_episodes.id
     LEFT JOIN metadata_items AS parent ON metadata_items.parent_id = parent.id
     LEFT JOIN metadata_items AS grandparent ON parent.parent_id = grandparent.id
-    LEFT JOIN (
+    JOIN (
         SELECT
             media_items.metadata_item_id,
             media_items.width,
             media_items.height,
             media_items.id,
-            /* use || as filename separator, to prevent || in filenames escape each | as \| */
-            GROUP_CONCAT(REPLACE(media_parts.file, '|', '\|'), '||') AS files
+            /* latest change of the media item or any of its parts, for --incremental */
+            MAX(
+                IFNULL(media_items.updated_at, 0),
+                IFNULL(MAX(media_parts.updated_at), 0)
+            ) AS updated_at
         FROM
             media_items
             LEFT JOIN media_parts ON media_parts.media_item_id = media_items.id
+        WHERE
+            media_items.metadata_item_id IN (SELECT id FROM section_episodes)
         GROUP BY
             media_items.id
     ) AS media ON media.metadata_item_id = metadata_items.id
+    JOIN media_parts ON media_parts.media_item_id = media.id
     LEFT JOIN (
         SELECT
             taggings.metadata_item_id,
-            MIN(imdb.tag) AS imdb,
-            MIN(tmdb.tag) AS tmdb,
-            MIN(tvdb.tag) AS tvdb
+            /* join tags once and pick the ids by prefix */
+            MIN(CASE WHEN tags.tag LIKE 'imdb://%' THEN tags.tag END) AS imdb,
+            MIN(CASE WHEN tags.tag LIKE 'tmdb://%' THEN tags.tag END) AS tmdb,
+            MIN(CASE WHEN tags.tag LIKE 'tvdb://%' THEN tags.tag END) AS tvdb
         FROM
             taggings
-            LEFT JOIN tags AS imdb ON taggings.tag_id = imdb.id
-            AND imdb.tag_type = 314
-            AND imdb.tag LIKE 'imdb://%'
-            LEFT JOIN tags AS tmdb ON taggings.tag_id = tmdb.id
-            AND tmdb.tag_type = 314
-            AND tmdb.tag LIKE 'tmdb://%'
-            LEFT JOIN tags AS tvdb ON taggings.tag_id = tvdb.id
-            AND tvdb.tag_type = 314
-            AND tvdb.tag LIKE 'tvdb://%'
+            JOIN tags ON taggings.tag_id = tags.id
+            AND tags.tag_type = 314
+        WHERE
+            taggings.metadata_item_id IN section_shows
         GROUP BY
             taggings.metadata_item_id
     ) AS tags ON tags.metadata_item_id = grandparent.id
 WHERE
     grandparent.title IS NOT NULL
     AND grandparent.title != ''
-    AND library_sections.name = :series_section_name
-    AND metadata_items.metadata_type = 4
-GROUP BY
-    media.id
+    /* --incremental: only fetch items changed since the last run */
+    AND (
+        :since IS NULL
+        OR changed_at >= :since
+    )
 ORDER BY
     grandparent.title ASC,
     season ASC,
-    episode ASC;
+    episode ASC,
+    /* parts of a media item must be adjacent and in order */
+    media.id ASC,
+    media_parts."index" ASC,
+    media_parts.file ASC;
 
 -- """
\ No newline at end of file
@@ -0,0 +1,71 @@
+"""State Module for normalize-plex-files
+
+Keeps track of the media items normalized by previous runs in a small
+SQLite3 sidecar database (see config.statefile). For every media item it
+records the Plex ids and the latest updated_at value seen, and whether
+all of its files could be moved.
+
+In --incremental mode since() returns the change filter for the search
+queries, so that only media items new or changed since the last run are
+fetched from the Plex database.
+"""
+
+import sqlite3
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS normalized (
+    database            TEXT NOT NULL,
+    section             TEXT NOT NULL,
+    metadata_item_id    INTEGER,
+    media_item_id       INTEGER NOT NULL,
+    updated_at          INTEGER,
+    done                INTEGER NOT NULL,
+    PRIMARY KEY (database, section, media_item_id)
+)
+"""
+
+
+def connect(statefile: str) -> sqlite3.Connection:
+    """opens (and if necessary creates) the state database {statefile}."""
+    con = sqlite3.connect(statefile)
+    con.execute(SCHEMA)
+    return con
+
+
+def since(con: sqlite3.Connection, database: str, sections: list[str]):
+    """returns the updated_at value to be used as change filter for library
+    {sections} of Plex database {database}, which are searched together:
+    - if media items failed in a previous run, the oldest of them, so they
+      will be retried,
+    - otherwise the newest updated_at value seen so far,
+    - None, if nothing has been recorded yet (i.e. process everything),
+    and of these the oldest of all {sections}."""
+    result = []
+    for section in sections:
+        value = con.execute("""
+            SELECT
+                IFNULL(
+                    (SELECT MIN(updated_at) FROM normalized
+                     WHERE database = :database AND section = :section AND NOT done),
+                    (SELECT MAX(updated_at) FROM normalized
+                     WHERE database = :database AND section = :section)
+                )
+            """, {"database": database, "section": section}).fetchone()[0]
+        if value is None:
+            return None
+        result.append(value)
+    return min(result, default=None)
+
+
+def record(con: sqlite3.Connection, database: str, section: str,
+           metadata_item_id: int, media_item_id: int, updated_at: int,
+           done: bool) -> None:
+    """records media item {media_item_id} as processed with change time
+    {updated_at}. {done} is false if any of its files could not be moved.
+    Changes become persistent with the next con.commit()."""
+    con.execute("""
+        INSERT OR REPLACE INTO normalized
+            (database, section, metadata_item_id, media_item_id, updated_at, done)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, (database, section, metadata_item_id, media_item_id, updated_at, done))
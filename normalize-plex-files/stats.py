@@ -0,0 +1,238 @@
+"""Statistics Module for normalize-plex-files
+
+Collects metrics of a run, to be written with --stats:
+- the wall time spent in each phase of the run (see PHASES); phases run
+  by several worker threads (see executor.py) add up the time of all
+  workers,
+- counters (see COUNTERS), e.g. of rows fetched, moves and errors,
+- the number of file system calls, by call.
+
+The metrics are written as JSON or as a Prometheus textfile (see
+FORMATS), e.g. for the textfile collector of the Prometheus node exporter.
+Runs of several profiles in other processes (see profiles.py) are merged
+into one report, with their totals and the metrics of each profile.
+
+Metrics are collected in module variables, so they do not have to be
+threaded through all functions; a lock protects them.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from typing import Iterable, Iterator
+from version import VERSION
+
+
+FORMATS = ("json", "prometheus")
+
+PHASES = ("config", "connect", "query", "fetch", "naming",
+          "mkdir", "link", "unlink", "cleanup", "throttle", "rescan")
+
+# counter -> description
+COUNTERS = {
+    "rows":         "rows fetched from the database",
+    "items":        "media items processed",
+    "parts":        "media parts processed",
+    "unchanged":    "media parts named correctly already",
+    "moves":        "moves computed or read from the plan file",
+    "skips":        "media parts skipped, e.g. outside of the base directory",
+    "filtered":     "media items left to other shards, see shard.py",
+    "collisions":   "target collisions found before moving, see preflight.py",
+    "completed":    "moves of an interrupted run completed, see utils.movefile()",
+    "dirrenames":   "directories renamed as a whole, see dirrename.py",
+    "rescans":      "partial scans requested from Plex, see rescan.py",
+    "errors":       "errors",
+}
+
+# prefix of the Prometheus metric names
+PREFIX = "normalize_plex_files"
+
+_seconds = dict.fromkeys(PHASES, 0.0)
+_counts = dict.fromkeys(COUNTERS, 0)
+_syscalls: dict[str, int] = {}
+# profile -> metrics of its run, see merge()
+_profiles: dict[str, dict] = {}
+_started = time.time()
+_lock = threading.Lock()
+
+
+def reset() -> None:
+    """resets all metrics, e.g. before another run in the same process
+    (see watch.py)."""
+    global _started
+    with _lock:
+        _seconds.update(dict.fromkeys(PHASES, 0.0))
+        _counts.update(dict.fromkeys(COUNTERS, 0))
+        _syscalls.clear()
+        _profiles.clear()
+        _started = time.time()
+
+
+def add(phase: str, seconds: float) -> None:
+    """adds {seconds} to the wall time of {phase}."""
+    with _lock:
+        _seconds[phase] += seconds
+
+
+@contextlib.contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """context manager adding the time spent in its body to {phase}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(phase, time.perf_counter() - start)
+
+
+def timediter(phase: str, iterable: Iterable) -> Iterator:
+    """yields the items of {iterable}, adding the time spent producing
+    them to {phase}."""
+    it = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            add(phase, time.perf_counter() - start)
+            return
+        add(phase, time.perf_counter() - start)
+        yield item
+
+
+def count(counter: str, n: int = 1) -> None:
+    """adds {n} to {counter}."""
+    with _lock:
+        _counts[counter] += n
+
+
+def syscall(call: str) -> None:
+    """counts a file system call {call}, e.g. "link"."""
+    with _lock:
+        _syscalls[call] = _syscalls.get(call, 0) + 1
+
+
+def snapshot() -> dict:
+    """returns the metrics collected, e.g. to be passed to merge() in
+    another process."""
+    with _lock:
+        return {
+            "started": _started,
+            "total": time.time() - _started,
+            "seconds": dict(_seconds),
+            "counts": dict(_counts),
+            "syscalls": dict(_syscalls),
+        }
+
+
+def merge(metrics: dict, profile: str) -> None:
+    """adds the {metrics} (see snapshot()) of the run of {profile} to the
+    metrics collected, and keeps them to be reported for {profile}."""
+    with _lock:
+        for phase, secs in metrics["seconds"].items():
+            _seconds[phase] += secs
+        for counter, n in metrics["counts"].items():
+            _counts[counter] += n
+        for call, n in metrics["syscalls"].items():
+            _syscalls[call] = _syscalls.get(call, 0) + n
+        _profiles[profile] = metrics
+
+
+def _json() -> str:
+    with _lock:
+        return json.dumps({
+            "version": VERSION,
+            "started": _started,
+            "seconds": {
+                "total": round(time.time() - _started, 6),
+                **{phase: round(secs, 6) for phase, secs in _seconds.items()},
+            },
+            "counts": dict(_counts),
+            "syscalls": dict(sorted(_syscalls.items())),
+            **({"profiles": {
+                profile: {
+                    "seconds": {
+                        "total": round(metrics["total"], 6),
+                        **{phase: round(secs, 6)
+                           for phase, secs in metrics["seconds"].items()},
+                    },
+                    "counts": metrics["counts"],
+                    "syscalls": dict(sorted(metrics["syscalls"].items())),
+                }
+                for profile, metrics in _profiles.items()
+            }} if _profiles else {}),
+        }, indent=2) + "\n"
+
+
+def _prometheus() -> str:
+    lines = [
+        f"# HELP {PREFIX}_phase_seconds Wall time spent in a phase of the last run.",
+        f"# TYPE {PREFIX}_phase_seconds gauge",
+    ]
+    with _lock:
+        lines += [
+            f'{PREFIX}_phase_seconds{{phase="{phase}"}} {secs:.6f}'
+            for phase, secs in _seconds.items()
+        ]
+        for counter, n in _counts.items():
+            lines += [
+                f"# HELP {PREFIX}_{counter} Number of {COUNTERS[counter]} in the last run.",
+                f"# TYPE {PREFIX}_{counter} gauge",
+                f"{PREFIX}_{counter} {n}",
+            ]
+        lines += [
+            f"# HELP {PREFIX}_syscalls Number of file system calls in the last run.",
+            f"# TYPE {PREFIX}_syscalls gauge",
+        ] + [
+            f'{PREFIX}_syscalls{{call="{call}"}} {n}'
+            for call, n in sorted(_syscalls.items())
+        ]
+        if _profiles:
+            lines += [
+                f"# HELP {PREFIX}_profile_seconds Duration of the last run of a profile.",
+                f"# TYPE {PREFIX}_profile_seconds gauge",
+            ] + [
+                f'{PREFIX}_profile_seconds{{profile="{profile}"}} {metrics["total"]:.6f}'
+                for profile, metrics in _profiles.items()
+            ] + [
+                f"# HELP {PREFIX}_profile_count Counters of the last run of a profile.",
+                f"# TYPE {PREFIX}_profile_count gauge",
+            ] + [
+                f'{PREFIX}_profile_count{{profile="{profile}",counter="{counter}"}} {n}'
+                for profile, metrics in _profiles.items()
+                for counter, n in metrics["counts"].items()
+            ]
+    lines += [
+        f"# HELP {PREFIX}_last_run_seconds Duration of the last run.",
+        f"# TYPE {PREFIX}_last_run_seconds gauge",
+        f"{PREFIX}_last_run_seconds {time.time() - _started:.6f}",
+        f"# HELP {PREFIX}_last_run_timestamp_seconds Start time of the last run.",
+        f"# TYPE {PREFIX}_last_run_timestamp_seconds gauge",
+        f"{PREFIX}_last_run_timestamp_seconds {_started:.3f}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def write(file: str, format: str = "json") -> None:
+    """writes the metrics to {file} (- for stdout) in {format}, one of
+    FORMATS. The file is replaced atomically, so a collector never reads
+    a partially written file. Raises OSError if the file cannot be
+    written."""
+    text = _prometheus() if format == "prometheus" else _json()
+
+    if file == "-":
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        return
+
+    tmp = f"{file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, file)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
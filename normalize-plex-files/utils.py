@@ -1,15 +1,23 @@
-import glob
+import functools
 import os
 import sys
 from pathlib import Path
 from types import SimpleNamespace
-import re
+from typing import Iterator, TextIO
+import sqlite3
+import dirindex
+import crossmove
+import scheduler
+import stats
+import journal
 
 
 TABLE = str.maketrans(
     '/:<>"\|?*',
     "∕꞉﹤﹥＂﹨｜？＊"
 )
+# number of leading dots -> replacement, see sanitize_filename()
+LEADINGDOTS = {3: "…", 2: "‥"}
 def sanitize_filename(filename: str) -> str:
     """Returns a filename with certain special-characters replaced by non-special characters.
 
@@ -40,9 +48,12 @@ def sanitize_filename(filename: str) -> str:
 
     result=filename.translate(TABLE)
 
-    result = re.sub(r'^\.\.\.([^\.])', r'…\1', result)
-    result = re.sub(r'^\.\.([^\.])', r'‥\1', result)
-    result = re.sub(r'^\.*', r'', result)
+    if result.startswith("."):
+        # same as replacing ^\.\.\.([^\.]) and ^\.\.([^\.]), then
+        # removing ^\.*, without running three regular expressions
+        name = result.lstrip(".")
+        result = LEADINGDOTS.get(len(result) - len(name), "") + name \
+            if name else ""
 
     if result == "":
         raise ValueError
@@ -64,50 +75,123 @@ def resolutionstring(height: int, width: int) -> str:
         return ""
 
 
-def deserializefilenames(serializedfilenames: str) -> list[str]:
-    r"""deserializes and unescapes filename lists previously serialised in the
-    SQL query:
-    - unescapes filenames:
-      "file\|name1" will become ["file|name1"],
-    - deserializes lists:
-      "file\|name1||file\|\|name2" will become ["file|name1","file||name2"]."""
-    # split files at filename separator || (inserted above in SQL code)
-    # and unescape all occurances of \| in filenames to | (escaped above)
+# number of rows fetched from the database at once by groupparts()
+BATCHSIZE = 1000
 
-    files = [f.replace(r'\|', '|') for f in serializedfilenames.split('||')]
-    files.sort()  # sort it - SQlite adds it in arbitrary order
 
-    return files
+def groupparts(cur: sqlite3.Cursor) -> Iterator[tuple[tuple, list[str]]]:
+    """groups the rows of a search query, which returns one row per media
+    part with the part's filename in the last column, by media item.
+    Yields (fields, parts) for each media item, with {fields} being the
+    columns except the filename, and {parts} being the filenames of all
+    parts of the media item, in the order returned by the query.
+    Rows are fetched in batches of BATCHSIZE, so only one batch of rows is
+    held in memory at a time."""
+    fields = None
+    parts = []
+
+    while True:
+        rows = cur.fetchmany(BATCHSIZE)
+        if not rows:
+            break
+        stats.count("rows", len(rows))
+        for row in rows:
+            if row[:-1] != fields:
+                if parts:
+                    yield fields, parts
+                fields = row[:-1]
+                parts = []
+            parts.append(row[-1])
+
+    if parts:
+        yield fields, parts
 
 
 def basedir(configuredbase: str, currentfile: str, depth: int = 1) -> str:
     """ensures that path of {currentfile} is below path {configuredbase},
     adds {depth} path elements from {currentfile} to {configuredbase}
-    and returns that to be used as the base path for the movie/series."""
-    base_dir = os.path.commonpath([configuredbase, currentfile])
+    and returns that to be used as the base path for the movie/series.
+    The result only depends on the directory of {currentfile}, so it is
+    memoized per directory."""
+    return _basedir(configuredbase, os.path.dirname(currentfile), depth)
+
+
+@functools.lru_cache(maxsize=4096)
+def _basedir(configuredbase: str, currentdir: str, depth: int) -> str:
+    base_dir = os.path.commonpath([configuredbase, currentdir])
 
     if base_dir != os.path.normpath(configuredbase):
         raise ValueError(
-            f'media file outside of configured base dir, file: {currentfile}, configured base dir: {configuredbase}')
+            f'media file outside of configured base dir, directory: {currentdir}, configured base dir: {configuredbase}')
 
     # get subdir(s) up to depth {depth} below configuredbase
-    relpath = os.path.relpath(os.path.dirname(currentfile), start=base_dir)
+    relpath = os.path.relpath(currentdir, start=base_dir)
     subdirs = Path(relpath).parts[0:depth]
 
     return (os.path.join(base_dir, *subdirs))
 
 
-def movemedia(old_file: str, new_file: str, config: SimpleNamespace) -> None:
+def movefile(file: str, new_file: str, out: TextIO, err: TextIO) -> bool:
+    """Moves the single file {file} to {new_file} without overwriting, by
+    hard link or copy (see crossmove.py) and unlink. If {new_file} exists
+    already as a hard link or complete copy of {file} (a move interrupted
+    before the unlink), only the unlink is done. Messages are written to
+    {out} and errors to {err}.
+    Returns False if the file could not be moved, True otherwise."""
+    try:
+        # move without overwriting
+        with stats.timed("link"):
+            copied = crossmove.transfer(file, new_file)
+    except FileExistsError as e:
+        if not crossmove.same(file, new_file):
+            print(e, file=err)
+            stats.count("errors")
+            return False
+        print(f"finishing interrupted move of {file}", file=out)
+        stats.count("completed")
+        copied = None
+    except Exception as e:
+        print(e, file=err)
+        stats.count("errors")
+        return False
+
+    dirindex.added(new_file)
+    if copied:
+        print(f"copied {file} ({crossmove.throughput(*copied)})", file=out)
+    # link or copy worked, now unlink old instance
+    stats.syscall("unlink")
+    scheduler.op(os.path.dirname(file))
+    try:
+        with stats.timed("unlink"):
+            os.unlink(file)
+    except Exception as e:
+        print(e, file=err)
+        stats.count("errors")
+        return False
+
+    dirindex.removed(file)
+    journal.done(file, new_file)
+    return True
+
+
+def movemedia(old_file: str, new_file: str, config: SimpleNamespace,
+              out: TextIO = None, err: TextIO = None) -> bool:
     """Moves all files with basename {old_file} and arbitrary extensions
     to {new_file} retaining the extensions when {config.armed} is true.
     {old_file} must not contain an filename-extension.
-    Does not overwrite existing files. Removes the old directory if empty after
-    operation.
-    Forcefully removes dot-files from the old directory to allow for directory
-    removal if {config.rmdotfiles} is true."""
+    Does not overwrite existing files. Files are hard linked to their new
+    name; across filesystems they are copied instead (see crossmove.py).
+    Removing the old directory is left to dirmanager.removedir().
+    Messages are written to {out} and errors to {err} (default: stdout and
+    stderr).
+    Returns False if any of the files could not be moved, True otherwise."""
     # old_file and new_file are basenames without file extensions.
     # The move concerns all files with these basenames, regardless of extension.
 
+    out = out or sys.stdout
+    err = err or sys.stderr
+    success = True
+
     # check if file should be actually moved
     if old_file != new_file:
         # yes!
@@ -115,45 +199,12 @@ def movemedia(old_file: str, new_file: str, config: SimpleNamespace) -> None:
             print(f"""would move:
 {old_file}
 {new_file}
-""")
+""", file=out)
         else:
             # seek all extensions of old_file (e.g. .m4v, .srt, ...)
-            for file in glob.glob(glob.escape(old_file)+'.*'):
+            for file in dirindex.sidecars(old_file):
                 ext = file.replace(old_file, "")
-                try:
-                    # move without overwriting
-                    os.link(file, new_file+ext)
-                except Exception as e:
-                    print(e, file=sys.stderr)
-                else:
-                    # link worked, now unlink old instance
-                    try:
-                        os.unlink(file)
-                    except Exception as e:
-                        print(e, file=sys.stderr)
-                    else:
-                        # try to remove old dir
-                        # (will fail, if this is not the last movie file)
-                        # prereq: remove dot files in dir, if config.rmdotfiles
-                        old_base_dir = os.path.dirname(old_file)
-                        if config.rmdotfiles:
-                            dotfiles = glob.glob(os.path.join(
-                                glob.escape(old_base_dir), '.??*'))
-                            for dotfile in dotfiles:
-                                print(f"removing {dotfile}")
-                                try:
-                                    os.unlink(dotfile)
-                                except Exception as e:
-                                    print(e, file=sys.stderr)
-                        # actual rmdir:
-                        # ignore if not empty (this only indicates that this file
-                        # was not the last movie file. Removal will be successful
-                        # after last movie file has been removed.^
-                        try:
-                            os.rmdir(old_base_dir)
-                        except OSError:
-                            pass  # not empty (expected)
-                        except Exception as e:
-                            print(e, file=sys.stderr)  # real error
-                        else:
-                            print(f"removed {old_base_dir}")
+                if not movefile(file, new_file+ext, out, err):
+                    success = False
+
+    return success
@@ -0,0 +1,112 @@
+"""Watch Module for normalize-plex-files
+
+Implements --watch: instead of being started by cron every few minutes,
+normalize-plex-files keeps running and only runs a normalization pass when
+Plex has actually written to its database.
+
+Every {config.watchinterval} seconds, the database is checked for changes
+cheaply, by
+- PRAGMA data_version, which changes whenever another connection (i.e.
+  Plex) has committed a transaction, and
+- the modification time and size of the database file and its write-ahead
+  log.
+After a change, a pass is only started once no further change has been
+seen for {config.watchquiet} seconds, so a library scan still running is
+not raced (debouncing). Passes are incremental (see state.py), so only
+media changed since the previous pass are processed.
+
+The connection used to check for changes stays open and is used for the
+passes as well, unless a snapshot of the database is queried.
+"""
+
+import os
+import pathlib
+import signal
+import sqlite3
+import sys
+import time
+from types import SimpleNamespace
+from typing import Callable
+import crossmove
+import dirindex
+import dirmanager
+import stats
+
+
+def signature(con: sqlite3.Connection, database: str) -> tuple:
+    """returns a tuple that changes whenever {database} has been changed:
+    the data_version of {con} and the modification times and sizes of
+    the database file and its write-ahead log."""
+    result = [con.execute("PRAGMA data_version").fetchone()[0]]
+    for file in (database, database + "-wal"):
+        try:
+            st = os.stat(file)
+        except FileNotFoundError:
+            result.append(None)
+        else:
+            result.append((st.st_mtime_ns, st.st_size))
+    return tuple(result)
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+
+def watch(config: SimpleNamespace,
+          run: Callable[[SimpleNamespace, sqlite3.Connection], None]) -> None:
+    """calls {run}(config, con) once, and again whenever the database has
+    changed and been quiet for {config.watchquiet} seconds, until
+    interrupted (SIGINT or SIGTERM). {con} is the open database connection,
+    or None if {config.snapshot} requires {run} to connect itself."""
+    database = os.path.abspath(config.database)
+    uri = pathlib.Path(database).as_uri() + "?mode=ro"
+    try:
+        con = sqlite3.connect(uri, uri=True)
+        last = signature(con, database)
+    except sqlite3.Error as e:
+        print(f"{e}: {config.database}")
+        sys.exit(1)
+
+    signal.signal(signal.SIGTERM, _terminate)
+
+    def normalize() -> bool:
+        # forget everything cached by the previous pass
+        dirindex.clear()
+        dirmanager.clear()
+        crossmove.clear()
+        stats.reset()
+
+        try:
+            run(config, con if config.snapshot == "off" else None)
+        except sqlite3.Error as e:
+            # e.g. database locked by Plex: retry after the next quiet period
+            print(e, file=sys.stderr)
+            return False
+
+        if config.stats:
+            try:
+                stats.write(config.stats, config.statsformat)
+            except OSError as e:
+                print(e, file=sys.stderr)
+        return True
+
+    try:
+        # monotonic time of the last change not processed yet
+        changed = None if normalize() else time.monotonic()
+
+        while True:
+            time.sleep(config.watchinterval)
+
+            current = signature(con, database)
+            if current != last:
+                if config.debug:
+                    print("Database changed.", file=sys.stderr)
+                last = current
+                changed = time.monotonic()
+            elif changed is not None \
+                    and time.monotonic() - changed >= config.watchquiet:
+                changed = None if normalize() else time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        con.close()